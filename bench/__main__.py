@@ -0,0 +1,170 @@
+"""
+Runs the cli subcommands against the local wanikani and anki-connect
+stand-ins and reports wall time, requests and peak memory (rss of the
+cli process) per step.
+
+    python -m bench --sizes 1000 9000 --json results.json
+    python -m bench --sizes 1000 9000 --compare results.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .anki import AnkiStandIn
+from .wanikani import WaniKaniStandIn
+
+DECK_NAME = "Bench::WaniKani"
+CLI = Path(__file__).parent.parent / "cli.py"
+
+CONFIG = """
+[user]
+api_token="bench"
+
+[deck]
+name="{deck}"
+audio_format="webm"
+
+[cache]
+dir="{cache_dir}"
+
+[learning]
+stability_req_for_learned_d=7
+
+[wanikani]
+url="{wk_url}"
+
+[anki]
+url="{anki_url}"
+media_transfer="{media_transfer}"
+"""
+
+def run_step(name: str, argv: list[str], wk: WaniKaniStandIn, anki: AnkiStandIn) -> dict:
+    wk.reset_counters()
+    anki.reset_counters()
+
+    # the cli runs in its own process, the memory of the stand-ins
+    # (serving it from this process) shouldn't count towards its peak
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, str(CLI), *argv])
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall_s = time.perf_counter() - start
+
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise Exception(f"{name} failed with exit code {proc.returncode}")
+
+    return dict(
+        # ru_maxrss is in KiB on linux
+        step=name, wall_s=wall_s, peak_mb=usage.ru_maxrss / 2**10,
+        wanikani_requests=dict(wk.requests), wanikani_bytes=wk.bytes_sent,
+        anki_requests=dict(anki.requests), anki_bytes=anki.bytes_received,
+    )
+
+def run_size(n_subjects: int, args: argparse.Namespace) -> list[dict]:
+    wk = WaniKaniStandIn(
+        n_subjects, latency_s=args.wk_latency, rate_limit=args.wk_rate_limit,
+        media_latency_s=args.media_latency
+    ).start()
+    anki = AnkiStandIn(
+        latency_s=args.anki_latency, note_latency_s=args.anki_note_latency,
+        rate_limit=args.anki_rate_limit
+    ).start()
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="wanideck-bench-") as tmp:
+            cache_dir = Path(tmp) / "cache"
+            cache_dir.mkdir()
+
+            config = Path(tmp) / "config.toml"
+            config.write_text(CONFIG.format(
+                deck=DECK_NAME, cache_dir=cache_dir, wk_url=wk.base_url,
+                anki_url=anki.url, media_transfer=args.media_transfer
+            ))
+
+            def step(name: str, *argv: str) -> dict:
+                logging.getLogger("Bench").info(f"{n_subjects} subjects: {name}")
+                result = run_step(name, ["-c", str(config), *["-v"] * args.verbose, *argv], wk, anki)
+                result["subjects"] = n_subjects
+                return result
+
+            results = [
+                step("init", "init"),
+                # nothing changed, only the checks remain
+                step("update (unchanged)", "update"),
+                step("progress (no reviews)", "progress"),
+            ]
+
+            reviewed = anki.simulate_reviews(DECK_NAME, args.review_fraction)
+            logging.getLogger("Bench").info(f"simulated {reviewed} reviews")
+            results.append(step("progress (after reviews)", "progress"))
+            # the reviews are in the sub decks, progress has to see them
+            if reviewed > 0 and results[-1]["anki_requests"].get("multi/cardReviews", 0) == 0:
+                raise AssertionError("progress missed the reviews of the sub decks")
+            results.append(step("syncuser", "syncuser"))
+            results.append(step("progress (after syncuser)", "progress"))
+
+            return results
+    finally:
+        wk.stop()
+        anki.stop()
+
+def _fmt_requests(requests: dict) -> str:
+    return ", ".join(f"{k}={v}" for k, v in sorted(requests.items(), key=lambda e: -e[1]))
+
+def print_results(results: list[dict], baseline: list[dict] | None = None):
+    base = {(r["subjects"], r["step"]): r for r in baseline or []}
+
+    print(f"{'subjects':>8}  {'step':<28} {'wall [s]':>9} {'Δ':>7} {'rss [MB]':>9} {'wk req':>6} {'anki req':>8}")
+    for r in results:
+        delta = ""
+        if (b := base.get((r["subjects"], r["step"]))) is not None and b["wall_s"] > 0:
+            delta = f"{(r['wall_s'] / b['wall_s'] - 1) * 100:+.0f}%"
+
+        print(
+            f"{r['subjects']:>8}  {r['step']:<28} {r['wall_s']:>9.2f} {delta:>7} {r['peak_mb']:>9.1f} "
+            f"{sum(r['wanikani_requests'].values()):>6} {sum(r['anki_requests'].values()):>8}"
+        )
+        print(f"{'':>10}wanikani: {_fmt_requests(r['wanikani_requests'])}")
+        print(f"{'':>10}anki: {_fmt_requests(r['anki_requests'])}")
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the cli against local stand-ins of wanikani and anki-connect")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000], help="amount of subjects of the generated decks")
+    parser.add_argument("--wk-latency", type=float, default=0.02, help="latency of each wanikani api request in s")
+    parser.add_argument("--wk-rate-limit", type=int, default=6000, help="wanikani requests per minute")
+    parser.add_argument("--media-latency", type=float, default=0.01, help="latency of each media download in s")
+    parser.add_argument("--anki-latency", type=float, default=0.002, help="latency of each anki-connect request in s")
+    parser.add_argument("--anki-note-latency", type=float, default=0.0005, help="latency per added note in s")
+    parser.add_argument("--anki-rate-limit", type=float, default=None, help="anki-connect requests per s")
+    parser.add_argument("--media-transfer", default="data", choices=["data", "path", "url"])
+    parser.add_argument("--review-fraction", type=float, default=0.1, help="fraction of unlocked cards reviewed between progress runs")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    parser.add_argument("--compare", type=Path, help="compare the wall time with results of an earlier --json")
+    parser.add_argument("-v", "--verbose", default=0, action="count")
+    args = parser.parse_args()
+
+    level = max(1, 3 - args.verbose) * 10
+    logging.basicConfig(level=level)
+    # some loggers set their own level, filter on the handler as well
+    for handler in logging.getLogger().handlers:
+        handler.setLevel(level)
+
+    results = []
+    for size in args.sizes:
+        results.extend(run_size(size, args))
+
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_results(results, baseline)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=1))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,424 @@
+"""
+Stand-in for anki-connect, the collection is kept in memory. It implements
+the actions (and the subset of the search syntax) this project uses.
+"""
+
+import base64
+import fnmatch
+import json
+import math
+import random
+import re
+import threading
+import time
+import dataclasses as ds
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable
+
+@ds.dataclass
+class _Model:
+    name: str
+    fields: list[str]
+    # name -> {Front, Back}
+    templates: dict[str, dict]
+    css: str = ""
+
+@ds.dataclass
+class _Note:
+    id: int
+    model: str
+    deck: str
+    fields: dict[str, str]
+    tags: list[str]
+    cards: list[int] = ds.field(default_factory=list)
+    mod: int = 0
+
+@ds.dataclass
+class _Card:
+    id: int
+    note: int
+    ord: int
+    deck: str
+    suspended: bool = False
+    interval: int = 0
+    due: int = 0
+    fsrs: dict | None = None
+
+class QueryError(Exception):
+    pass
+
+_TOKEN = re.compile(r'-?"[^"]*"|-?\(|\)|[^\s()]+')
+
+class AnkiStandIn:
+    """
+    Serves the anki-connect protocol (version 6) on a local port.
+
+    Actions are processed one after the other, like anki does on its main
+    thread. latency_s is added to every request and note_latency_s to every
+    note that is added, rate_limit limits the requests per second.
+    """
+
+    def __init__(self, latency_s: float = 0, note_latency_s: float = 0, rate_limit: float | None = None) -> None:
+        self.latency_s = latency_s
+        self.note_latency_s = note_latency_s
+        self.rate_limit = rate_limit
+
+        # counted per action, actions in multi are counted as multi/<action>
+        self.requests: Counter[str] = Counter()
+        self.bytes_received = 0
+
+        self.decks: dict[str, int] = {"Default": 1}
+        self.models: dict[str, _Model] = dict()
+        self.notes: dict[int, _Note] = dict()
+        self.cards: dict[int, _Card] = dict()
+        self.media: dict[str, int] = dict()
+        # [reviewTime, cardID, usn, buttonPressed, newInterval, previousInterval, newFactor, reviewDuration, reviewType]
+        self.reviews: list[list] = []
+
+        self._next_id = int(time.time() * 1000)
+        self._lock = threading.Lock()
+        self._last_request = 0.0
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self) -> "AnkiStandIn":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests.clear()
+            self.bytes_received = 0
+
+    def _new_id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    ##############
+    ### search ###
+    ##############
+
+    def _term(self, term: str) -> Callable[[_Card, _Note], bool]:
+        if term.startswith('"'):
+            term = term[1:-1]
+
+        key, sep, value = term.partition(":")
+        if not sep:
+            raise QueryError(f"unsupported search term {term}")
+
+        match key.lower():
+            case "deck":
+                return lambda c, n: c.deck == value or c.deck.startswith(value + "::")
+            case "note":
+                return lambda c, n: n.model == value
+            case "tag":
+                return lambda c, n: value.lower() in (t.lower() for t in n.tags)
+            case "nid":
+                ids = {int(i) for i in value.split(",") if i}
+                return lambda c, n: n.id in ids
+            case "cid":
+                ids = {int(i) for i in value.split(",") if i}
+                return lambda c, n: c.id in ids
+            case "card":
+                return lambda c, n: c.ord == int(value) - 1
+            case "is":
+                if value != "suspended":
+                    raise QueryError(f"unsupported search term {term}")
+                return lambda c, n: c.suspended
+            case field:
+                return lambda c, n: n.fields.get(field, "").lower() == value.lower()
+
+    def _parse(self, tokens: list[str]) -> Callable[[_Card, _Note], bool]:
+        """all terms of a group have to match (or those of one side of an OR),
+        -term and -( group ) negate"""
+        alternatives = [[]]
+        while tokens:
+            token = tokens.pop(0)
+            if token == ")":
+                break
+            if token == "OR":
+                alternatives.append([])
+                continue
+
+            negate = token.startswith("-")
+            if negate:
+                token = token[1:]
+
+            pred = self._parse(tokens) if token == "(" else self._term(token)
+            alternatives[-1].append((lambda p: lambda c, n: not p(c, n))(pred) if negate else pred)
+
+        return lambda c, n: any(all(p(c, n) for p in preds) for preds in alternatives)
+
+    def _search_cards(self, query: str) -> list[_Card]:
+        pred = self._parse(_TOKEN.findall(query))
+        return [c for c in self.cards.values() if pred(c, self.notes[c.note])]
+
+    ###############
+    ### actions ###
+    ###############
+
+    def _note_fields(self, note: _Note) -> dict:
+        model = self.models[note.model]
+        return {
+            name: dict(value=note.fields.get(name, ""), order=i)
+            for i, name in enumerate(model.fields)
+        }
+
+    def _add_note(self, note: dict) -> int:
+        model = self.models.get(note["modelName"])
+        if model is None:
+            raise Exception(f"model was not found: {note['modelName']}")
+        if note["deckName"] not in self.decks:
+            raise Exception(f"deck was not found: {note['deckName']}")
+
+        fields = {k: str(v) for k, v in note["fields"].items()}
+        if not fields.get(model.fields[0]):
+            raise Exception("cannot create note because it is empty")
+
+        # anki checks the first field for duplicates
+        options = note.get("options", {})
+        if not options.get("allowDuplicate", False):
+            first = fields[model.fields[0]]
+            for other in self.notes.values():
+                if other.model == model.name and other.fields.get(model.fields[0]) == first \
+                        and (options.get("duplicateScope") != "deck" or other.deck == note["deckName"]):
+                    raise Exception("cannot create note because it is a duplicate")
+
+        time.sleep(self.note_latency_s)
+
+        n = _Note(
+            id=self._new_id(), model=model.name, deck=note["deckName"],
+            fields=fields, tags=list(note.get("tags", [])), mod=int(time.time())
+        )
+        for ord, _ in enumerate(model.templates):
+            card = _Card(id=self._new_id(), note=n.id, ord=ord, deck=n.deck)
+            self.cards[card.id] = card
+            n.cards.append(card.id)
+        self.notes[n.id] = n
+
+        for media in note.get("audio", []) + note.get("picture", []) + note.get("video", []):
+            self._store_media(**media)
+
+        return n.id
+
+    def _store_media(self, filename: str, data: str | None = None, path: str | None = None, url: str | None = None, **_) -> str:
+        if data is not None:
+            size = len(base64.b64decode(data))
+        elif path is not None:
+            size = Path(path).stat().st_size
+        elif url is not None:
+            # no downloads in the stand-in
+            size = 0
+        else:
+            raise Exception("You must provide a \"data\", \"path\", or \"url\" field.")
+        self.media[filename] = size
+        return filename
+
+    def _card_info(self, card: _Card) -> dict:
+        note = self.notes[card.note]
+        return dict(
+            cardId=card.id, note=note.id, ord=card.ord,
+            deckName=card.deck, modelName=note.model,
+            fields=self._note_fields(note), fsrs=card.fsrs,
+            interval=card.interval, due=card.due, queue=-1 if card.suspended else 0,
+        )
+
+    def _deck_cards(self, deck: str, sub_decks: bool = True) -> set[int]:
+        return {
+            c.id for c in self.cards.values()
+            if c.deck == deck or (sub_decks and c.deck.startswith(deck + "::"))
+        }
+
+    def _dispatch(self, action: str, params: dict) -> Any:
+        match action:
+            case "version":
+                return 6
+            case "sync":
+                return None
+            case "multi":
+                results = []
+                for a in params["actions"]:
+                    self.requests["multi/" + a["action"]] += 1
+                    try:
+                        results.append(dict(result=self._dispatch(a["action"], a.get("params", {})), error=None))
+                    except Exception as e:
+                        results.append(dict(result=None, error=str(e)))
+                return results
+
+            case "deckNames":
+                return list(self.decks)
+            case "deckNamesAndIds":
+                return dict(self.decks)
+            case "createDeck":
+                return self.decks.setdefault(params["deck"], self._new_id())
+
+            case "modelNames":
+                return list(self.models)
+            case "createModel":
+                model = _Model(
+                    name=params["modelName"], fields=list(params["inOrderFields"]),
+                    templates={t["Name"]: dict(Front=t["Front"], Back=t["Back"]) for t in params["cardTemplates"]},
+                    css=params.get("css", ""),
+                )
+                self.models[model.name] = model
+                return dict(name=model.name)
+            case "modelFieldNames":
+                return list(self.models[params["modelName"]].fields)
+            case "modelFieldAdd":
+                self.models[params["modelName"]].fields.append(params["fieldName"])
+                return None
+            case "modelStyling":
+                return dict(css=self.models[params["modelName"]].css)
+            case "updateModelStyling":
+                self.models[params["model"]["name"]].css = params["model"]["css"]
+                return None
+            case "modelTemplates":
+                return dict(self.models[params["modelName"]].templates)
+            case "updateModelTemplates":
+                self.models[params["model"]["name"]].templates.update(params["model"]["templates"])
+                return None
+            case "modelTemplateAdd":
+                t = params["template"]
+                self.models[params["modelName"]].templates[t["Name"]] = dict(Front=t["Front"], Back=t["Back"])
+                return None
+            case "modelTemplateRemove":
+                del self.models[params["modelName"]].templates[params["templateName"]]
+                return None
+
+            case "addNote":
+                return self._add_note(params["note"])
+            case "addNotes":
+                ids, errors = [], []
+                for note in params["notes"]:
+                    try:
+                        ids.append(self._add_note(note))
+                    except Exception as e:
+                        ids.append(None)
+                        errors.append(str(e))
+                # like anki-connect, the other notes are added nevertheless
+                if errors:
+                    raise Exception(errors)
+                return ids
+            case "updateNoteFields":
+                note = self.notes[params["note"]["id"]]
+                note.fields.update({k: str(v) for k, v in params["note"]["fields"].items()})
+                note.mod = int(time.time())
+                return None
+            case "findNotes":
+                return list(dict.fromkeys(c.note for c in self._search_cards(params["query"])))
+            case "findCards":
+                return [c.id for c in self._search_cards(params["query"])]
+            case "notesInfo":
+                if "notes" in params:
+                    notes = [self.notes[id] for id in params["notes"] if id in self.notes]
+                else:
+                    notes = [self.notes[id] for id in self._dispatch("findNotes", params)]
+                return [dict(
+                    noteId=n.id, profile="User 1", modelName=n.model, tags=n.tags,
+                    fields=self._note_fields(n), mod=n.mod, cards=n.cards,
+                ) for n in notes]
+            case "cardsInfo":
+                return [self._card_info(self.cards[id]) for id in params["cards"] if id in self.cards]
+
+            case "areSuspended":
+                return [self.cards[id].suspended if id in self.cards else None for id in params["cards"]]
+            case "suspend" | "unsuspend":
+                for id in params["cards"]:
+                    self.cards[id].suspended = action == "suspend"
+                return True
+            case "setDueDate":
+                days = params["days"]
+                set_interval = days.endswith("!")
+                days = int(days.rstrip("!").split("-")[0])
+                for id in params["cards"]:
+                    self.cards[id].due = days
+                    if set_interval:
+                        self.cards[id].interval = days
+                return True
+
+            # like anki-connect, only the cards of the exact deck (without sub decks)
+            case "getLatestReviewID":
+                ids = self._deck_cards(params["deck"], sub_decks=False)
+                return max((r[0] for r in self.reviews if r[1] in ids), default=0)
+            case "cardReviews":
+                ids = self._deck_cards(params["deck"], sub_decks=False)
+                return [r for r in self.reviews if r[1] in ids and r[0] > params["startID"]]
+
+            case "storeMediaFile":
+                return self._store_media(**params)
+            case "getMediaFilesNames":
+                return fnmatch.filter(self.media, params.get("pattern", "*"))
+
+            case _:
+                raise Exception("unsupported action")
+
+    def simulate_reviews(self, deck: str, fraction: float, seed: int = 0) -> int:
+        """reviews a fraction of the unsuspended cards of deck, like a user
+        between two progress runs would. returns the number of reviewed cards"""
+        rnd = random.Random(seed)
+        with self._lock:
+            ids = sorted(id for id in self._deck_cards(deck) if not self.cards[id].suspended)
+            reviewed = rnd.sample(ids, k=math.ceil(len(ids) * fraction))
+
+            review_id = max(int(time.time() * 1000), max((r[0] for r in self.reviews), default=0))
+            for id in reviewed:
+                card = self.cards[id]
+                review_id += 1
+                stability = rnd.uniform(0.5, 2) * max(1, card.interval)
+                card.fsrs = dict(stability=stability, difficulty=rnd.uniform(1, 10), retrievability=0.9)
+                self.reviews.append([review_id, id, -1, 3, int(stability), card.interval, 0, 5000, 1])
+                card.interval = int(stability)
+
+        return len(reviewed)
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, don't let them wait for an ack
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+                with standin._lock:
+                    if standin.rate_limit:
+                        wait = standin._last_request + 1 / standin.rate_limit - time.monotonic()
+                        if wait > 0:
+                            time.sleep(wait)
+                        standin._last_request = time.monotonic()
+                    time.sleep(standin.latency_s)
+
+                    request = json.loads(body) if body else dict(action="version")
+                    action = request.get("action", "")
+                    standin.requests[action] += 1
+                    standin.bytes_received += len(body)
+
+                    try:
+                        response = dict(result=standin._dispatch(action, request.get("params", {})), error=None)
+                    except Exception as e:
+                        response = dict(result=None, error=str(e))
+
+                data = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            # anki-connect doesn't care about the method
+            do_GET = do_POST
+
+        return Handler
@@ -0,0 +1,209 @@
+"""
+Checks the unlock decisions of ProgressState against a plain per-card
+implementation of the algorithm (as process_progress did before the
+card table) on random synthetic decks, for full and incremental
+evaluations. Afterwards both evaluations are timed on a large deck.
+
+    python -m bench.progress_check --decks 50 --cards 200000
+"""
+
+import argparse
+import math
+import random
+import sys
+import time
+from dataclasses import dataclass
+
+from wanideck.cardtable import KANJI, RADICAL, STYPES, CardTable
+from wanideck.notes import Card, CardMemoryState, CardMetadata
+from wanideck.progress import ProgressState
+from wanideck.subjects import SubjectTypes
+
+VOCAB = STYPES.index(SubjectTypes.VOCAB)
+
+@dataclass
+class _Card:
+    id: int
+    sub_id: int
+    stability: float | None
+    interval: int
+    suspended: bool
+
+@dataclass
+class _Subject:
+    level: int
+    stype: int
+    requirements: list[int]
+
+def generate_deck(rnd: random.Random, n_cards: int, max_level: int = 60) -> tuple[dict[int, _Subject], list[_Card]]:
+    """subjects of random levels, kanji require radicals and vocab kanji of
+    lower or equal levels. Cards of higher levels are suspended"""
+    subjects: dict[int, _Subject] = dict()
+    by_type: dict[int, list[int]] = {RADICAL: [], KANJI: [], VOCAB: []}
+    cards: list[_Card] = []
+    unlocked_level = rnd.randint(1, max_level)
+
+    sub_id = 0
+    while len(cards) < n_cards:
+        sub_id += 1
+        level = rnd.randint(1, max_level)
+        stype = rnd.choices([RADICAL, KANJI, VOCAB], [1, 2, 4])[0]
+        req_type = {RADICAL: None, KANJI: RADICAL, VOCAB: KANJI}[stype]
+
+        requirements = []
+        if req_type is not None:
+            known = by_type[req_type]
+            requirements = rnd.sample(known, k=min(len(known), rnd.randint(1, 3)))
+        subjects[sub_id] = _Subject(level, stype, requirements)
+        by_type[stype].append(sub_id)
+
+        for _ in range(1 if stype == RADICAL else 2):
+            cards.append(_Card(
+                id=len(cards) + 1, sub_id=sub_id,
+                # some cards are reviewed without FSRS
+                stability=None if rnd.random() < 0.2 else rnd.uniform(0, 20),
+                interval=rnd.randint(0, 20),
+                suspended=level > unlocked_level or rnd.random() < 0.3,
+            ))
+
+    return subjects, cards
+
+def build_table(subjects: dict[int, _Subject], cards: list[_Card]) -> CardTable:
+    table = CardTable()
+    for c in cards:
+        s = subjects[c.sub_id]
+        table.card_id.append(c.id)
+        table.note_id.append(c.sub_id)
+        table.sub_id.append(c.sub_id)
+        table.stype.append(s.stype)
+        table.level.append(s.level)
+        table.stability.append(math.nan if c.stability is None else c.stability)
+        table.interval.append(c.interval)
+        table.suspended.append(c.suspended)
+        table.requirements.setdefault(c.sub_id, list(s.requirements))
+    return table
+
+def reference(subjects: dict[int, _Subject], cards: list[_Card], stability_req_d: int) -> tuple[int, set[int]]:
+    """the unlock algorithm card by card, returns the level and the cards to unsuspend"""
+    level = 1
+    for c in cards:
+        if not c.suspended and subjects[c.sub_id].stype == RADICAL:
+            level = max(level, subjects[c.sub_id].level)
+
+    learned_subs: dict[int, bool] = dict()
+    for c in cards:
+        if c.stability is not None:
+            is_learned = c.stability >= stability_req_d
+        else:
+            is_learned = c.interval >= stability_req_d
+        learned_subs[c.sub_id] = learned_subs.setdefault(c.sub_id, True) & is_learned
+
+    kanji = [c.sub_id for c in cards if subjects[c.sub_id].level == level and subjects[c.sub_id].stype == KANJI]
+    if len([id for id in kanji if learned_subs[id]]) >= len(kanji) * 0.9:
+        level += 1
+
+    unsuspend = set()
+    for c in cards:
+        s = subjects[c.sub_id]
+        if s.level <= level and all(learned_subs[id] for id in s.requirements):
+            unsuspend.add(c.id)
+    return level, unsuspend
+
+def review(rnd: random.Random, cards: list[_Card], k: int) -> list[Card]:
+    """changes k random cards (like reviews would) and returns them as anki cards"""
+    reviewed = []
+    for c in rnd.sample(cards, k=min(k, len(cards))):
+        c.stability = None if rnd.random() < 0.1 else rnd.uniform(0, 20)
+        c.interval = rnd.randint(0, 20)
+        reviewed.append(Card(
+            deck="", model="", fields=None, is_suspended=None, note=None,  # type: ignore
+            metadata=CardMetadata(card_id=c.id, note_id=c.sub_id),
+            memory_state=None if c.stability is None else CardMemoryState(stability=c.stability, difficulty=5),
+            interval=c.interval,
+        ))
+    return reviewed
+
+def unsuspend(cards: list[_Card], state: ProgressState, card_ids: list[int]):
+    ids = set(card_ids)
+    for c in cards:
+        if c.id in ids:
+            c.suspended = False
+    state.set_suspended(card_ids, False)
+
+def check_deck(seed: int, n_cards: int, rounds: int, stability_req_d: int = 7) -> bool:
+    rnd = random.Random(seed)
+    subjects, cards = generate_deck(rnd, n_cards)
+
+    state = ProgressState(deck="check", review_id=0, level=1, table=build_table(subjects, cards))
+    level, expected = reference(subjects, cards, stability_req_d)
+    got = state.evaluate(stability_req_d)
+    if (state.level, set(got)) != (level, expected):
+        print(f"deck {seed}: full evaluation differs (level {state.level} != {level})")
+        return False
+    unsuspend(cards, state, got)
+
+    for i in range(rounds):
+        if rnd.random() < 0.3:
+            # like a new process, that loads the state from its file
+            state = ProgressState(deck="check", review_id=0, level=state.level, table=CardTable.from_dict(state.table.to_dict()))
+
+        newly_learned = state.update_cards(review(rnd, cards, rnd.randint(1, 50)), stability_req_d)
+        got = state.evaluate(stability_req_d, newly_learned)
+        level, expected = reference(subjects, cards, stability_req_d)
+
+        # unsuspending a card that isn't suspended changes nothing
+        suspended = {c.id for c in cards if c.suspended}
+        if state.level != level or set(got) & suspended != expected & suspended:
+            print(f"deck {seed}: incremental evaluation {i} differs (level {state.level} != {level})")
+            return False
+        unsuspend(cards, state, got)
+
+    return True
+
+def time_evaluations(n_cards: int, n_reviews: int, stability_req_d: int = 7):
+    rnd = random.Random(0)
+    subjects, cards = generate_deck(rnd, n_cards)
+    table = build_table(subjects, cards)
+    data = table.to_dict()
+
+    start = time.perf_counter()
+    state = ProgressState(deck="check", review_id=0, level=1, table=table)
+    state.evaluate(stability_req_d)
+    full_s = time.perf_counter() - start
+
+    reviewed = review(rnd, cards, n_reviews)
+
+    # a new process loads the state and evaluates the reviewed cards
+    loaded = ProgressState(deck="check", review_id=0, level=state.level, table=CardTable.from_dict(data))
+    start = time.perf_counter()
+    loaded.evaluate(stability_req_d, loaded.update_cards(reviewed, stability_req_d))
+    loaded_s = time.perf_counter() - start
+
+    # a long running process (serve) keeps the state in memory
+    reviewed = review(rnd, cards, n_reviews)
+    start = time.perf_counter()
+    loaded.evaluate(stability_req_d, loaded.update_cards(reviewed, stability_req_d))
+    kept_s = time.perf_counter() - start
+
+    print(
+        f"{len(cards)} cards, {n_reviews} reviews: full {full_s * 1000:.1f}ms, "
+        f"incremental after load {loaded_s * 1000:.1f}ms, incremental in memory {kept_s * 1000:.1f}ms"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="check the progress evaluation against a reference implementation")
+    parser.add_argument("--decks", type=int, default=50, help="amount of random decks to check")
+    parser.add_argument("--deck-cards", type=int, default=2000, help="cards of each checked deck")
+    parser.add_argument("--rounds", type=int, default=20, help="incremental evaluations per deck")
+    parser.add_argument("--cards", type=int, default=200000, help="cards of the timed deck")
+    parser.add_argument("--reviews", type=int, default=100, help="reviewed cards of the timed incremental evaluations")
+    args = parser.parse_args()
+
+    failed = [seed for seed in range(args.decks) if not check_deck(seed, args.deck_cards, args.rounds)]
+    print(f"{args.decks - len(failed)}/{args.decks} decks match the reference")
+
+    time_evaluations(args.cards, args.reviews)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
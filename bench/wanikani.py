@@ -0,0 +1,275 @@
+"""
+Stand-in for the wanikani api (and its media cdn) serving synthetic
+subjects, assignments and the user. Latency and rate limit are configurable.
+"""
+
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PAGE_SIZE = 1000
+ASSIGNMENT_PAGE_SIZE = 500
+MAX_LEVEL = 60
+
+def _iso(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+def _parse_iso(ts: str) -> datetime:
+    return datetime.fromisoformat(ts.replace("Z", "+00:00"))
+
+def _sample_ids(rnd: random.Random, subjects: list[dict], max_level: int, k: int) -> list[int]:
+    """ids of up to k random subjects of max_level or below"""
+    candidates = [s["id"] for s in subjects if s["data"]["level"] <= max_level]
+    return rnd.sample(candidates, k=min(k, len(candidates)))
+
+def generate_subjects(n: int, base_url: str, seed: int = 0) -> list[dict]:
+    """generates n subjects (radicals : kanji : vocab = 1 : 2 : 4) spread over all levels"""
+    rnd = random.Random(seed)
+    created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+    n_rad = max(1, n // 7)
+    n_kan = max(1, 2 * n // 7)
+    n_voc = max(1, n - n_rad - n_kan)
+
+    def level_of(i: int, count: int) -> int:
+        return 1 + i * MAX_LEVEL // count
+
+    subjects = []
+    radicals, kanji = [], []
+
+    def common(id: int, obj: str, level: int, slug: str, meaning: str) -> dict:
+        return dict(
+            id=id, object=obj, url=f"{base_url}subjects/{id}",
+            data_updated_at=_iso(created + timedelta(seconds=id)),
+            data=dict(
+                level=level, slug=slug, lesson_position=id % 30, hidden_at=None,
+                meanings=[dict(meaning=meaning, primary=True, accepted_answer=True)],
+                meaning_mnemonic=f"<p>meaning mnemonic of {slug} " + "lorem ipsum " * 20 + "</p>",
+                amalgamation_subject_ids=[],
+            )
+        )
+
+    id = 1
+    for i in range(n_rad):
+        level = level_of(i, n_rad)
+        s = common(id, "radical", level, f"radical{i}", f"radical {i}")
+        if i % 10 == 0:
+            s["data"]["characters"] = None
+            s["data"]["character_images"] = [dict(
+                url=f"{base_url}media/radical{i}.svg", content_type="image/svg+xml", metadata={}
+            )]
+        else:
+            s["data"]["characters"] = chr(0x2E80 + i)
+            s["data"]["character_images"] = []
+        radicals.append(s)
+        id += 1
+
+    for i in range(n_kan):
+        level = level_of(i, n_kan)
+        s = common(id, "kanji", level, f"kanji{i}", f"kanji {i}")
+        s["data"].update(
+            characters=chr(0x4E00 + i),
+            readings=[
+                dict(reading=f"on{i}", primary=True, type="onyomi"),
+                dict(reading=f"kun{i}", primary=False, type="kunyomi"),
+            ],
+            meaning_hint="hint", reading_mnemonic="reading mnemonic " * 20, reading_hint="hint",
+            component_subject_ids=_sample_ids(rnd, radicals, level, 2),
+        )
+        kanji.append(s)
+        id += 1
+
+    for i in range(n_voc):
+        level = level_of(i, n_voc)
+        chars = f"語{i}"
+        s = common(id, "vocabulary", level, chars, f"vocab {i}")
+        s["data"].update(
+            characters=chars,
+            readings=[dict(reading=f"go{i}", primary=True, accepted_answer=True)],
+            parts_of_speech=["noun"],
+            context_sentences=[dict(ja=f"文{i}", en=f"sentence {i}")] * 3,
+            reading_mnemonic="reading mnemonic " * 20,
+            component_subject_ids=_sample_ids(rnd, kanji, level, 2),
+            pronunciation_audios=[dict(
+                url=f"{base_url}media/vocab{i}_{gender}.webm", content_type="audio/webm",
+                metadata=dict(gender=gender)
+            ) for gender in ["male", "female"]],
+        )
+        id += 1
+        subjects.append(s)
+
+    # set the reverse edges
+    all_subjects = radicals + kanji + subjects
+    by_id = {s["id"]: s for s in all_subjects}
+    for s in all_subjects:
+        for req in s["data"].get("component_subject_ids", []):
+            by_id[req]["data"]["amalgamation_subject_ids"].append(s["id"])
+
+    return all_subjects
+
+def generate_assignments(subjects: list[dict], fraction: float = 0.5, seed: int = 0) -> list[dict]:
+    rnd = random.Random(seed)
+    now = datetime.now(tz=timezone.utc)
+
+    assignments = []
+    for s in subjects:
+        if rnd.random() > fraction:
+            continue
+        stage = rnd.randint(1, 9)
+        assignments.append(dict(
+            id=s["id"], object="assignment", data_updated_at=_iso(now - timedelta(days=1)),
+            data=dict(
+                subject_id=s["id"], subject_type=s["object"], srs_stage=stage,
+                available_at=None if stage == 9 else _iso(now + timedelta(hours=rnd.randint(-48, 24 * 30))),
+            )
+        ))
+    return assignments
+
+class WaniKaniStandIn:
+    """serves /subjects, /assignments, /user and /media/<name> on a local port"""
+
+    def __init__(
+            self, n_subjects: int, latency_s: float = 0, rate_limit: int = 6000,
+            media_latency_s: float | None = None, seed: int = 0
+        ) -> None:
+        self.latency_s = latency_s
+        self.media_latency_s = latency_s if media_latency_s is None else media_latency_s
+        self.rate_limit = rate_limit
+        self.requests: Counter[str] = Counter()
+        self.bytes_sent = 0
+
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._window_count = 0
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}/v2/"
+
+        self.subjects = generate_subjects(n_subjects, self.base_url, seed)
+        self.assignments = generate_assignments(self.subjects, seed=seed)
+
+    def start(self) -> "WaniKaniStandIn":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests.clear()
+            self.bytes_sent = 0
+
+    def _take_rate_limit(self) -> tuple[bool, dict]:
+        """fixed window of 60 s like wanikani"""
+        with self._lock:
+            now = time.time()
+            if now - self._window_start >= 60:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+
+            allowed = self._window_count <= self.rate_limit
+            headers = {
+                "RateLimit-Limit": str(self.rate_limit),
+                "RateLimit-Remaining": str(max(0, self.rate_limit - self._window_count)),
+                "RateLimit-Reset": str(int(self._window_start + 60)),
+            }
+            return allowed, headers
+
+    def _page(self, path: str, items: list[dict], query: dict, page_size: int) -> dict:
+        after = int(query.get("page_after_id", ["0"])[0])
+        remaining = [i for i in items if i["id"] > after]
+        page = remaining[:page_size]
+
+        next_url = None
+        if len(remaining) > page_size:
+            params = {k: v[0] for k, v in query.items() if k != "page_after_id"}
+            params["page_after_id"] = str(page[-1]["id"])
+            next_url = f"{self.base_url}{path}?" + "&".join(f"{k}={v}" for k, v in params.items())
+
+        return dict(
+            object="collection", url=f"{self.base_url}{path}",
+            pages=dict(next_url=next_url, previous_url=None, per_page=page_size),
+            total_count=len(items),
+            data_updated_at=max((i["data_updated_at"] for i in items), default=None),
+            data=page,
+        )
+
+    def _filter(self, items: list[dict], query: dict) -> list[dict]:
+        if "updated_after" in query:
+            after = _parse_iso(query["updated_after"][0])
+            items = [i for i in items if _parse_iso(i["data_updated_at"]) > after]
+        if "levels" in query:
+            levels = {int(l) for l in query["levels"][0].split(",")}
+            items = [i for i in items if i["data"]["level"] in levels]
+        if "hidden" in query:
+            hidden = query["hidden"][0] == "true"
+            items = [i for i in items if (i["data"].get("hidden_at") is not None) == hidden]
+        return items
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, don't let them wait for an ack
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str, headers: dict = {}):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+                with standin._lock:
+                    standin.bytes_sent += len(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                endpoint = url.path.removeprefix("/v2/").split("/")[0]
+
+                with standin._lock:
+                    standin.requests[endpoint] += 1
+
+                if endpoint == "media":
+                    time.sleep(standin.media_latency_s)
+                    # fake media, the content only depends on the name
+                    self._send(200, url.path.encode() * 200, "application/octet-stream")
+                    return
+
+                time.sleep(standin.latency_s)
+                allowed, headers = standin._take_rate_limit()
+                if not allowed:
+                    self._send(429, b'{"error": "Rate limit exceeded", "code": 429}', "application/json", headers)
+                    return
+
+                if endpoint == "subjects":
+                    body = standin._page("subjects", standin._filter(standin.subjects, query), query, PAGE_SIZE)
+                elif endpoint == "assignments":
+                    body = standin._page("assignments", standin._filter(standin.assignments, query), query, ASSIGNMENT_PAGE_SIZE)
+                elif endpoint == "user":
+                    body = dict(object="user", data=dict(
+                        username="bench", level=1,
+                        subscription=dict(active=True, type="lifetime", max_level_granted=MAX_LEVEL)
+                    ))
+                else:
+                    self._send(404, b'{"error": "not found"}', "application/json", headers)
+                    return
+
+                self._send(200, json.dumps(body).encode(), "application/json", headers)
+
+        return Handler
@@ -5,8 +5,11 @@ Simple cli to manage your wanikani->anki lessons
 
 import argparse
 import logging
+from pathlib import Path
+from wanideck import profiling
 from wanideck.config import Config
 from wanideck.wanideck import WaniDeck
+from wanideck.serve import DeckServer
 
 def build_parser():
     parser = argparse.ArgumentParser(description=__doc__)
@@ -17,10 +20,15 @@ def build_parser():
 
     parser.add_argument("--insert-individually", action="store_true", help="If set, each card will be inserted individually - helps debug problems but slower")
 
+    parser.add_argument("--profile", type=Path, help="Write a json report with the time spent per phase and request to this file")
+    parser.add_argument("--profile-cpu", action="store_true", help="Add a cProfile summary to the profile (slower)")
+    parser.add_argument("--profile-memory", action="store_true", help="Add a tracemalloc summary to the profile (slower)")
+
     sub = parser.add_subparsers(required=True, dest='submodule')
 
     init = sub.add_parser("init", help="initialize the anki deck")
     init.add_argument("--no-download", action="store_true", help="Do not download cards from WaniKani")
+    init.add_argument("--export-apkg", type=Path, metavar="PATH", help="Build the deck offline into an .apkg to import into Anki (Anki is not needed)")
 
     syncuser = sub.add_parser("syncuser", help="sync user data from wanikani to anki")
 
@@ -28,6 +36,8 @@ def build_parser():
 
     progress = sub.add_parser("progress", help="process progress - unlock new cards if possible")
 
+    serve = sub.add_parser("serve", help="keep running and do progress, syncuser and update periodically (see [serve] in config)")
+
     return parser
 
 def main():
@@ -36,13 +46,35 @@ def main():
     # setup logging using verbosity level
     logging.basicConfig(level=max(1, 3 - args.verbose) * 10)
 
+    run(args)
+
+def run(args: argparse.Namespace):
     logging.debug(f"Arguments namespace: {args}")
 
     conf = Config.load(args.config)
 
+    profiler = None
+    if args.profile is not None:
+        profiler = profiling.enable(cpu=args.profile_cpu, memory=args.profile_memory)
+
     wanideck = WaniDeck(conf)
 
+    try:
+        run_command(args, conf, wanideck)
+    finally:
+        if profiler is not None:
+            profiling.disable()
+            profiler.write(args.profile, command=args.submodule, rate_limit_wait_s=wanideck.rate_limit_wait_s)
+
+def run_command(args: argparse.Namespace, conf: Config, wanideck: WaniDeck):
+    if args.submodule in ("update", "progress", "syncuser", "serve"):
+        # a single read unless our models changed, catches outdated templates
+        wanideck.check_models()
+
     match args.submodule:
+        case "init" if args.export_apkg is not None:
+            wanideck.export_apkg(args.export_apkg, not args.disable_suspend_new)
+
         case "init":
             wanideck.create_deck()
 
@@ -66,6 +98,13 @@ def main():
         case "syncuser":
             wanideck.enter_wanikani_status_in_anki()
 
+        case "serve":
+            server = DeckServer(
+                wanideck, conf, not args.disable_suspend_new, args.insert_individually, args.sync
+            )
+            server.serve_forever()
+            return
+
     if args.sync:
         wanideck.do_webanki_sync()
 
@@ -1,5 +1,6 @@
-import json
 import requests
+import time
+from sys import intern
 import dataclasses as ds
 
 from typing import Any, Type
@@ -7,10 +8,21 @@ from typing import Any, Type
 import logging
 
 from .models import CardTemplate, Model
+from .session import create_session
+from . import fastjson, profiling
 from .notes import Card, CardMemoryState, CardMetadata, Note, NoteMetadata, Fields
 
 logger = logging.getLogger("AnkiConnect")
 
+class BatchError(Exception):
+    """raised if actions of a batch failed, errors maps
+    the tag of each failed action to its error. results are
+    those of all actions (None for failed ones)"""
+    def __init__(self, errors: list[tuple[Any, str]], results: list[Any] | None = None) -> None:
+        self.errors = errors
+        self.results = results if results is not None else []
+        super().__init__(f"{len(errors)} actions failed: {errors[:5]}{'..' if len(errors) > 5 else ''}")
+
 class AnkiConnect:
     @ds.dataclass
     class NewNote:
@@ -37,19 +49,73 @@ class AnkiConnect:
 
             return params
 
-    def __init__(self, base_url: str = "http://127.0.0.1:8765") -> None:
+    class ActionBatch:
+        """Queues actions and sends them in groups of size using the multi action.
+        Each action can be tagged (e.g. with its note id), failed actions are
+        reported with their tag in a BatchError after all actions were sent."""
+
+        def __init__(self, anki: "AnkiConnect", size: int) -> None:
+            self._anki = anki
+            self._size = max(1, size)
+            self._actions: list[tuple[Any, dict]] = []
+
+        def __len__(self) -> int:
+            return len(self._actions)
+
+        def __enter__(self) -> "AnkiConnect.ActionBatch":
+            return self
+
+        def __exit__(self, exc_type, exc, tb):
+            if exc_type is None:
+                self.flush()
+
+        def add(self, action: str, tag: Any = None, **params):
+            self._actions.append((tag, self._anki._request(action, **params)))
+
+        def flush(self) -> list[Any]:
+            """sends all queued actions and returns their results (None for failed ones)"""
+            actions, self._actions = self._actions, []
+
+            results, errors = [], []
+            for i in range(0, len(actions), self._size):
+                chunk = actions[i:i + self._size]
+                for (tag, _), res in zip(chunk, self._anki.multi([a for _, a in chunk])):
+                    # with version 6 each result is wrapped into result / error
+                    if isinstance(res, dict) and "error" in res:
+                        if res["error"] is not None:
+                            errors.append((tag, res["error"]))
+                        res = res.get("result")
+                    results.append(res)
+
+            if len(errors) > 0:
+                raise BatchError(errors, results)
+            return results
+
+    def __init__(
+            self, base_url: str = "http://127.0.0.1:8765",
+            session: requests.Session | None = None, timeout: float | None = None,
+            batch_size: int = 100
+        ) -> None:
         self._base_url = base_url
-        pass
+        self._session = session if session is not None else create_session()
+        self._timeout = timeout
+        self._batch_size = batch_size
 
     def _request(self, action: str, **params) -> dict:
         return {'action': action, 'params': params, 'version': 6}
 
     def _invoke(self, action: str, **params) -> Any:
-        requestJson = json.dumps(self._request(action, **params)).encode('utf-8')
+        requestJson = fastjson.dumps(self._request(action, **params))
         logger.debug(f"Requesting {action} to anki-connect (data={requestJson[:150] + (requestJson[150:] and b'..')})")
-        r = requests.get(self._base_url, data=requestJson)
-
-        response = r.json()
+        start = time.perf_counter()
+        r = self._session.get(self._base_url, data=requestJson, timeout=self._timeout)
+        profiling.record_request("anki", action, time.perf_counter() - start, len(requestJson), len(r.content))
+        if action == "multi":
+            # the time is accounted to multi, but count what it contained
+            for a in params["actions"]:
+                profiling.record_request("anki", f"multi/{a['action']}", 0)
+
+        response = fastjson.loads(r.content)
         if len(response) != 2:
             raise Exception('response has an unexpected number of fields')
         if 'error' not in response:
@@ -60,6 +126,20 @@ class AnkiConnect:
             raise Exception(response['error'])
         return response['result']
 
+    def _invoke_or_queue(self, batch: "AnkiConnect.ActionBatch | None", tag: Any, action: str, **params) -> Any:
+        """invokes the action directly or queues it into batch (if given)"""
+        if batch is None:
+            return self._invoke(action, **params)
+        batch.add(action, tag, **params)
+
+    def multi(self, actions: list[dict]) -> list[Any]:
+        return self._invoke("multi", actions=actions)
+
+    def batch(self, size: int | None = None) -> "AnkiConnect.ActionBatch":
+        """create a batch of actions, use it as a context manager
+        to send them when leaving the context"""
+        return AnkiConnect.ActionBatch(self, self._batch_size if size is None else size)
+
     def sync(self):
         self._invoke("sync")
 
@@ -130,8 +210,8 @@ class AnkiConnect:
     def addModelTemplate(self, model: str, template: CardTemplate):
         self._invoke('modelTemplateAdd', modelName=model, template=ds.asdict(template))
 
-    def addNote(self, new_note: NewNote) -> int:
-        return self._invoke('addNote', note=new_note.to_params())
+    def addNote(self, new_note: NewNote, batch: ActionBatch | None = None, tag: Any = None) -> int:
+        return self._invoke_or_queue(batch, tag, 'addNote', note=new_note.to_params())
 
     def addNotes(self, new_notes: list[NewNote]):
         return self._invoke('addNotes', notes=[n.to_params() for n in new_notes])
@@ -151,7 +231,7 @@ class AnkiConnect:
             logging.error(f"Found {len(notes)} matches. This is not a single match")
             return None
 
-    def updateNoteFields(self, id:int, fields: dict | Fields):
+    def updateNoteFields(self, id:int, fields: dict | Fields, batch: ActionBatch | None = None):
         if isinstance(fields, Fields):
             fields = fields.to_dict()
 
@@ -159,25 +239,29 @@ class AnkiConnect:
             id=id,
             fields=fields
         )
-        self._invoke("updateNoteFields", note=params)
+        self._invoke_or_queue(batch, id, "updateNoteFields", note=params)
 
     def getNotesInfo(
             self, *, notes_id: list[int] | None = None, query: str | None = None,
-            fields: None | Type[Fields] = None
+            fields: None | Type[Fields] = None, only: tuple[str, ...] | None = None
         ) -> list[Note]:
+        """fields is the class the fields are decoded into, with only
+        just the given fields are decoded"""
         params = dict()
         if notes_id is not None:
             params["notes"] = notes_id
         if query is not None:
             params["query"] = query
 
+        decode = None if fields is None else fields.decoder(only)
+
         notes = []
         for elem in self._invoke("notesInfo", **params):
             notes.append(Note(
                 deck=None,
-                model=elem["modelName"],
-                tags=elem["tags"],
-                fields=elem["fields"] if fields is None else fields.from_dict(elem["fields"]),
+                model=intern(elem["modelName"]),
+                tags=[intern(t) for t in elem["tags"]],
+                fields=elem["fields"] if decode is None else decode(elem["fields"]),
                 metadata=NoteMetadata(
                     mod=elem["mod"],
                     cards=elem["cards"],
@@ -189,14 +273,29 @@ class AnkiConnect:
 
     def getCardsInfo(
             self, *, cards_id: list[int],
-            fields: None | Type[Fields] = None
+            fields: None | Type[Fields] = None, only: tuple[str, ...] | None = None,
+            notes: dict[int, Note] | None = None
         ) -> list[Card]:
+        """if notes (by note id) are given, cards of these notes are linked
+        to them and reference their fields instead of keeping a copy.
+        Otherwise fields / only work like in getNotesInfo"""
+        decode = None if fields is None else fields.decoder(only)
+
         cards = []
         for elem in self._invoke("cardsInfo", cards=cards_id):
+            note = None if notes is None else notes.get(elem["note"])
+
+            if note is not None:
+                card_fields = note.fields
+            elif decode is not None:
+                card_fields = decode(elem["fields"])
+            else:
+                card_fields = elem["fields"]
+
             cards.append(Card(
-                deck=elem["deckName"],
-                model=elem["modelName"],
-                fields=elem["fields"] if fields is None else fields.from_dict(elem["fields"]),
+                deck=intern(elem["deckName"]),
+                model=intern(elem["modelName"]),
+                fields=card_fields,
                 memory_state=None if not elem["fsrs"] else CardMemoryState(
                     stability=elem["fsrs"]["stability"],
                     difficulty=elem["fsrs"]["difficulty"]
@@ -208,10 +307,19 @@ class AnkiConnect:
 
                 interval=int(elem["interval"]),
                 is_suspended=None,
-                note=None,
+                note=note,
             ))
         return cards
 
+    def getLatestReviewID(self, deck: str, batch: ActionBatch | None = None) -> int:
+        """unix time (ms) of the latest review in deck (without its sub decks), 0 if there is none"""
+        return self._invoke_or_queue(batch, deck, "getLatestReviewID", deck=deck)
+
+    def cardReviews(self, deck: str, start_id: int, batch: ActionBatch | None = None) -> list[list]:
+        """all reviews of deck (without its sub decks) after start_id, each review is
+        [reviewTime, cardID, usn, buttonPressed, newInterval, previousInterval, newFactor, reviewDuration, reviewType]"""
+        return self._invoke_or_queue(batch, deck, "cardReviews", deck=deck, startID=start_id)
+
     def areSuspended(self, cards_id: list[int]) -> dict[int, bool]:
         return dict(zip(cards_id, self._invoke("areSuspended", cards=cards_id)))
 
@@ -221,11 +329,17 @@ class AnkiConnect:
     def suspend(self, cards_id: list[int]):
         self._invoke("suspend", cards=cards_id)
 
-    def setDueDate(self, cards_id: list[int], days: int, set_interval: bool):
+    def setDueDate(self, cards_id: list[int], days: int, set_interval: bool, batch: ActionBatch | None = None):
         """for days see anki-connect description"""
-        self._invoke("setDueDate", cards=cards_id, days=f"{days}{'!' * set_interval}")
+        self._invoke_or_queue(batch, days, "setDueDate", cards=cards_id, days=f"{days}{'!' * set_interval}")
+
+    def getMediaFilesNames(self, pattern: str = "*") -> list[str]:
+        return self._invoke("getMediaFilesNames", pattern=pattern)
 
-    def storeMediaFile(self, filename: str, data: str | None = None, path: str | None = None, url: str | None = None):
+    def storeMediaFile(
+            self, filename: str, data: str | None = None, path: str | None = None, url: str | None = None,
+            batch: ActionBatch | None = None
+        ):
         params = dict(filename=filename)
         if data is not None:
             params["data"] = data
@@ -234,7 +348,7 @@ class AnkiConnect:
         if url is not None:
             params["url"] = url
 
-        self._invoke("storeMediaFile", **params)
+        self._invoke_or_queue(batch, filename, "storeMediaFile", **params)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,78 @@
+import hashlib
+import logging
+from pathlib import Path
+
+import genanki
+
+from .models import Model, get_models
+from .notes import Note
+
+logger = logging.getLogger("Apkg")
+
+def _stable_id(name: str) -> int:
+    """genanki wants fixed ids for models and decks, derive them from the name
+    (in the range genanki suggests)"""
+    digest = int.from_bytes(hashlib.sha1(name.encode()).digest()[:4], "big")
+    return (1 << 30) + digest % (1 << 30)
+
+class ApkgBuilder:
+    """
+    Collects notes (with their models and decks) and media into an
+    anki package. Notes get a guid derived from the deck and a key, so
+    that importing a newer package updates the notes instead of adding them.
+    """
+
+    def __init__(self, deck_name: str) -> None:
+        self._deck_name = deck_name
+        # our models by name, notes only reference them by name
+        self._known_models = {m.name: m for m in get_models()}
+        self._models: dict[str, genanki.Model] = dict()
+        self._decks: dict[str, genanki.Deck] = dict()
+        self._media: list[Path] = []
+
+    def _get_model(self, model: Model) -> genanki.Model:
+        if model.name not in self._models:
+            self._models[model.name] = genanki.Model(
+                model_id=_stable_id(model.name),
+                name=model.name,
+                fields=[dict(name=f) for f in model.fields],
+                templates=[dict(name=t.Name, qfmt=t.Front, afmt=t.Back) for t in model.templates],
+                css=model.css or "",
+                model_type=genanki.Model.CLOZE if model.isCloze else genanki.Model.FRONT_BACK,
+            )
+        return self._models[model.name]
+
+    def _get_deck(self, name: str) -> genanki.Deck:
+        if name not in self._decks:
+            self._decks[name] = genanki.Deck(_stable_id(name), name)
+        return self._decks[name]
+
+    def add_note(self, note: Note, key: int | str, suspended: bool = False):
+        """adds the note into its deck, key must be unique within the deck"""
+        model = self._get_model(self._known_models[note.model])
+
+        fields = note.fields.to_dict()
+        gnote = genanki.Note(
+            model=model,
+            fields=[fields[f["name"]] for f in model.fields],
+            tags=note.tags,
+            guid=genanki.guid_for(self._deck_name, key),
+        )
+        for card in gnote.cards:
+            card.suspend = suspended
+
+        assert note.deck is not None
+        self._get_deck(note.deck).add_note(gnote)
+
+    def add_media(self, paths: list[Path]):
+        self._media.extend(paths)
+
+    def write(self, path: Path):
+        # the parent deck should exist, even if it only contains sub decks
+        self._get_deck(self._deck_name)
+
+        package = genanki.Package(list(self._decks.values()))
+        package.media_files = [str(p) for p in dict.fromkeys(self._media)]
+        package.write_to_file(str(path))
+
+        logger.info(f"Wrote {len(self._decks)} decks and {len(package.media_files)} media files to {path}")
@@ -0,0 +1,172 @@
+import math
+import dataclasses as ds
+from array import array
+from collections import Counter
+from functools import cached_property
+from itertools import compress
+
+from .notes import Card
+from .subjects import SubjectTypes
+
+# subject types are stored as their index in SubjectTypes
+STYPES = list(SubjectTypes)
+RADICAL = STYPES.index(SubjectTypes.RADICALS)
+KANJI = STYPES.index(SubjectTypes.KANJI)
+UNKNOWN = -1
+
+@ds.dataclass
+class CardTable:
+    """
+    Columnar representation of the cards of our deck, it contains just what
+    the unlock algorithm needs. Each column is an array with one entry per card.
+    Unknown levels are stored as 0, a missing FSRS stability as nan.
+
+    The rows don't change once the table is built (only their values),
+    so the lookups into them are built once and kept.
+    """
+    card_id: array = ds.field(default_factory=lambda: array("q"))
+    note_id: array = ds.field(default_factory=lambda: array("q"))
+    sub_id: array = ds.field(default_factory=lambda: array("q"))
+    stype: array = ds.field(default_factory=lambda: array("b"))
+    level: array = ds.field(default_factory=lambda: array("h"))
+    stability: array = ds.field(default_factory=lambda: array("d"))
+    interval: array = ds.field(default_factory=lambda: array("q"))
+    suspended: array = ds.field(default_factory=lambda: array("b"))
+
+    # sub_id -> requirements
+    requirements: dict[int, list[int]] = ds.field(default_factory=dict)
+
+    @classmethod
+    def from_cards(cls, cards: list[Card]) -> "CardTable":
+        """builds the table from cards, their notes must be linked"""
+        table = cls()
+        for card in cards:
+            if card.note is None:
+                continue
+
+            sub_id = card.sub_id
+            tags = [t.lower() for t in card.note.tags]
+
+            table.card_id.append(card.metadata.card_id)
+            table.note_id.append(card.metadata.note_id)
+            table.sub_id.append(sub_id)
+            table.stype.append(next(
+                (i for i, t in enumerate(STYPES) if t.name.lower() in tags), UNKNOWN
+            ))
+            table.level.append(card.note.level or 0)
+            table.stability.append(math.nan if card.memory_state is None else card.memory_state.stability)
+            table.interval.append(card.interval)
+            table.suspended.append(bool(card.is_suspended))
+
+            if sub_id not in table.requirements:
+                table.requirements[sub_id] = list(card.note.fields.requirements)
+
+        return table
+
+    def __len__(self) -> int:
+        return len(self.card_id)
+
+    @cached_property
+    def _rows(self) -> dict[int, int]:
+        """row of each card id"""
+        return {id: i for i, id in enumerate(self.card_id)}
+
+    @cached_property
+    def _radical_rows(self) -> list[int]:
+        return [i for i, t in enumerate(self.stype) if t == RADICAL]
+
+    @cached_property
+    def _kanji_by_level(self) -> dict[int, list[int]]:
+        """sub_ids of the kanji cards (one entry per card) by level"""
+        kanji: dict[int, list[int]] = dict()
+        for sub_id, t, l in zip(self.sub_id, self.stype, self.level):
+            if t == KANJI:
+                kanji.setdefault(l, []).append(sub_id)
+        return kanji
+
+    def _is_learned(self, i: int, stability_req_d: int) -> bool:
+        st = self.stability[i]
+        return self.interval[i] >= stability_req_d if math.isnan(st) else st >= stability_req_d
+
+    def update_cards(self, cards: list[Card], stability_req_d: int) -> list[tuple[int, bool, bool]]:
+        """update stability and interval of cards in the table, returns
+        (sub_id, learned before, learned after) of the updated cards"""
+        changes = []
+        for card in cards:
+            if (i := self._rows.get(card.metadata.card_id)) is None:
+                continue
+            before = self._is_learned(i, stability_req_d)
+            self.stability[i] = math.nan if card.memory_state is None else card.memory_state.stability
+            self.interval[i] = card.interval
+            changes.append((self.sub_id[i], before, self._is_learned(i, stability_req_d)))
+        return changes
+
+    def set_suspended(self, card_ids: list[int], suspended: bool):
+        for id in card_ids:
+            if (i := self._rows.get(id)) is not None:
+                self.suspended[i] = suspended
+
+    def learned(self, stability_req_d: int) -> list[bool]:
+        """per card, if its stability (or interval without FSRS) reaches stability_req_d"""
+        # st != st is the inlined isnan
+        return [
+            iv >= stability_req_d if st != st else st >= stability_req_d
+            for st, iv in zip(self.stability, self.interval)
+        ]
+
+    def unlearned_counts(self, stability_req_d: int) -> Counter[int]:
+        """per subject, the number of its cards that are not learned.
+        A subject is learned if all of its cards are learned (its count is 0)"""
+        return Counter(compress(self.sub_id, [not l for l in self.learned(stability_req_d)]))
+
+    def current_level(self) -> int:
+        """the highest level of an unsuspended radical (at least 1)"""
+        levels = [self.level[i] for i in self._radical_rows if not self.suspended[i]]
+        if 0 in levels:
+            raise ValueError("The note should have a level")
+        return max(levels, default=1)
+
+    def kanji_cards_of_level(self, level: int) -> list[int]:
+        """sub_ids of all kanji cards of level (one entry per card)"""
+        return self._kanji_by_level.get(level, [])
+
+    def unlockable_cards(self, level: int, learned_subs: dict[int, bool], candidates: set[int] | None = None) -> list[int]:
+        """cards of subjects (of candidates, if given) below or equal level,
+        whose requirements are all learned"""
+        if candidates is not None:
+            if len(candidates) == 0:
+                return []
+            # a single pass over the sub_ids, only the rows of the candidates are looked at further
+            rows = [i for i, sub_id in enumerate(self.sub_id) if sub_id in candidates]
+            cards = [(self.card_id[i], self.sub_id[i]) for i in rows if 0 < self.level[i] <= level]
+            unlockable = {
+                sub_id for sub_id in {sub_id for _, sub_id in cards}
+                if all(map(lambda id: learned_subs[id], self.requirements[sub_id]))
+            }
+            return [card_id for card_id, sub_id in cards if sub_id in unlockable]
+
+        eligible = set(compress(self.sub_id, (0 < l <= level for l in self.level)))
+        unlockable = {
+            sub_id for sub_id in eligible
+            if all(map(lambda id: learned_subs[id], self.requirements[sub_id]))
+        }
+        return list(compress(self.card_id, (sub_id in unlockable for sub_id in self.sub_id)))
+
+    def subjects_of_levels(self, min_level: int, max_level: int) -> set[int]:
+        """sub_ids with min_level < level <= max_level"""
+        return set(compress(self.sub_id, (min_level < l <= max_level for l in self.level)))
+
+    def to_dict(self) -> dict:
+        data = {f.name: getattr(self, f.name).tolist() for f in ds.fields(self) if f.name != "requirements"}
+        data["requirements"] = self.requirements
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CardTable":
+        table = cls()
+        for f in ds.fields(cls):
+            if f.name != "requirements":
+                getattr(table, f.name).extend(data[f.name])
+        # json only knows string keys
+        table.requirements = {int(k): v for k, v in data["requirements"].items()}
+        return table
@@ -1,7 +1,7 @@
 import os
 import toml
 from pathlib import Path
-from dataclasses import dataclass, fields
+from dataclasses import MISSING, dataclass, fields
 from enum import Enum
 
 @dataclass
@@ -22,6 +22,12 @@ class Config:
                 case self.MPEG:
                     return "mpeg"
 
+    class MediaTransfer(Enum):
+        """how media files are handed to anki"""
+        DATA = "data"  # base64 encoded in the request (works with remote ankis)
+        PATH = "path"  # path of the file in our cache dir
+        URL = "url"  # anki downloads the file from the cdn itself
+
     user_api_token: str
 
     deck_name: str
@@ -32,6 +38,35 @@ class Config:
     # the amount of days required for stability for a card to be considered learned
     learning_stability_req_for_learned_d: int
 
+    # amount of parallel downloads from the wanikani media cdn
+    media_concurrency: int = 8
+
+    # connection pool per client and timeout of wanikani / cdn requests
+    http_pool_size: int = 10
+    http_timeout_s: float = 30
+    http_keep_alive: bool = True
+
+    wanikani_url: str = "https://api.wanikani.com/v2/"
+    # full subject downloads are split into this many level ranges, that are downloaded in parallel
+    wanikani_download_partitions: int = 4
+
+    anki_url: str = "http://127.0.0.1:8765"
+    # anki can take quite some time for bulk actions
+    anki_timeout_s: float = 600
+    # amount of actions that are grouped into a single multi request
+    anki_batch_size: int = 100
+    anki_media_transfer: MediaTransfer = MediaTransfer.DATA
+    # initial amount of notes per addNotes, adapted to reach the target duration
+    anki_insert_chunk_size: int = 100
+    anki_insert_target_s: float = 2
+
+    # cadences of the serve command, 0 disables the command
+    serve_progress_interval_s: float = 300
+    serve_syncuser_interval_s: float = 3600
+    serve_update_interval_s: float = 86400
+    # progress is also evaluated if the anki collection file (collection.anki2) changes
+    serve_collection_path: str = ""
+    serve_poll_s: float = 10
 
     @classmethod
     def load(cls, conf_file: str | Path) -> "Config":
@@ -47,11 +82,16 @@ class Config:
             val = os.environ.get(f"WK_{field.name.upper()}")
             if val is None:
                 val = flattend.get(field.name)
+            if val is None and field.default is not MISSING:
+                val = field.default
 
             if val is None:
                 raise ValueError(f"{field.name} could not be found in config file or env")
 
             try:
+                if field.type is bool and isinstance(val, str):
+                    # bool("false") would be true
+                    val = val.lower() in ("1", "true", "yes")
                 flattend[field.name] = field.type(val)
             except Exception as e:
                 raise ValueError(f"{field.name} value {val} is incomp. with {field.type}", e)
@@ -1,11 +1,14 @@
+import json
+import time
 import logging
 from typing import Callable
 from datetime import datetime
 
-from .subjects import RadicalSubject, KanjiSubject, SubjectBase, VocabSubject
-from .models import Model, get_model_metadata
+from .subjects import SubjectBase
+from .models import Model, get_model_fingerprints, get_model_metadata, get_models
 from .notes import Card, MetadataFields, get_note_metadata, Note
-from .ankiconnect import AnkiConnect
+from .ankiconnect import AnkiConnect, BatchError
+from .cardtable import CardTable
 from .models import Model
 from .subjects import SubjectTypes
 
@@ -16,12 +19,43 @@ class DeckBuilder:
     Our anki deck builder which suppords building,
     but also integrating updated / new anki flash cards
     from wanikani.
+
+    The state of the deck is read once per run and kept in a snapshot,
+    our own writes are applied to the snapshot instead of reloading it.
     """
 
-    def __init__(self, anki_connect: AnkiConnect, deck_name: str) -> None:
+    def __init__(
+            self, anki_connect: AnkiConnect, deck_name: str,
+            insert_chunk_size: int = 100, insert_target_s: float = 2
+        ) -> None:
         self._anki_api = anki_connect
         self._deckname = deck_name
 
+        # chunked insertion of notes, the chunk size adapts to the
+        # latency of anki, so that each addNotes takes about insert_target_s
+        self._insert_chunk_size = insert_chunk_size
+        self._insert_target_s = insert_target_s
+        # (sub_id, error) of notes anki refused to add in this run
+        self.rejected_notes: list[tuple[int, str]] = []
+
+        # snapshot of the deck (None if not loaded or invalidated)
+        self._metadata_note_id: int | None = None
+        self._metadata_fields: MetadataFields | None = None
+        self._notes: dict[int, Note[SubjectBase.Fields]] | None = None
+        self._cards: dict[int, Card] | None = None
+        self._suspended: dict[int, bool] | None = None
+
+    def invalidate(self, keep_notes: bool = False):
+        """drop the snapshot, e.g. if the deck was changed outside of this builder.
+        With keep_notes, only the cards (which change with reviews) are dropped"""
+        self._cards = None
+        self._suspended = None
+
+        if not keep_notes:
+            self._metadata_note_id = None
+            self._metadata_fields = None
+            self._notes = None
+
     def _get_anki_deck_name(self, subname: SubjectTypes | None = None):
         if subname is None:
             return self._deckname
@@ -33,20 +67,104 @@ class DeckBuilder:
     def complete_note(self, name: SubjectTypes | None, note_fn: Callable[[str], Note]):
         return note_fn(self._get_anki_deck_name(name))
 
-    def get_metadata_note(self) -> int:
-        notes = self._anki_api.findNotes(f"\"deck:{self._get_anki_deck_name()}\" \"note:{get_model_metadata().name}\"")
+    def get_latest_review_id(self) -> int:
+        # anki-connect only looks at the exact deck, but our cards are in the sub decks
+        with self._anki_api.batch() as batch:
+            for t in SubjectTypes:
+                self._anki_api.getLatestReviewID(self._get_anki_deck_name(t), batch=batch)
+            review_ids = batch.flush()
+        return max(review_ids, default=0)
+
+    def get_reviewed_cards(self, since_review_id: int) -> list[Card]:
+        """cards of this deck that were reviewed after since_review_id
+        (without suspension state and note)"""
+        with self._anki_api.batch() as batch:
+            for t in SubjectTypes:
+                self._anki_api.cardReviews(self._get_anki_deck_name(t), since_review_id, batch=batch)
+            reviews = [review for deck_reviews in batch.flush() for review in deck_reviews]
+        card_ids = list({review[1] for review in reviews})
+        if len(card_ids) == 0:
+            return []
+        return self._anki_api.getCardsInfo(cards_id=card_ids)
+
+    def _load_metadata(self):
+        """reads the metadata note (id and fields) with a single request"""
+        notes = self._anki_api.getNotesInfo(
+            query=f"\"deck:{self._get_anki_deck_name()}\" \"note:{get_model_metadata().name}\"",
+            fields=MetadataFields
+        )
         assert len(notes) == 1, "Why are there multiple cards with metadata model in this deck?"
-        return notes[0]
+        assert notes[0].metadata is not None
+        self._metadata_note_id = notes[0].metadata.note_id
+        self._metadata_fields = notes[0].fields
+
+    def get_metadata_note(self) -> int:
+        if self._metadata_note_id is None:
+            self._load_metadata()
+        assert self._metadata_note_id is not None
+        return self._metadata_note_id
 
     def set_metadata_time(self, ftype: MetadataFields.Types, time: datetime):
         mnote_id = self.get_metadata_note()
         fields = {ftype.value: str(int(time.timestamp()))}
         self._anki_api.updateNoteFields(mnote_id, fields)
 
+        if self._metadata_fields is not None:
+            setattr(self._metadata_fields, ftype.value, fields[ftype.value])
+
     def get_metadata_time(self, ftype: MetadataFields.Types) -> int:
-        id = self.get_metadata_note()
-        note = self._anki_api.getNotesInfo(notes_id=[id], fields=MetadataFields)[0].fields
-        return int(getattr(note, ftype.value))
+        if self._metadata_fields is None:
+            self._load_metadata()
+        return int(getattr(self._metadata_fields, ftype.value))
+
+    def get_model_fingerprints(self) -> dict[str, str]:
+        """fingerprints of the models as they were last checked in anki"""
+        if self._metadata_fields is None:
+            self._load_metadata()
+        assert self._metadata_fields is not None
+        raw = self._metadata_fields.model_fingerprints
+        return json.loads(raw) if raw else dict()
+
+    def set_model_fingerprints(self, fingerprints: dict[str, str]):
+        mnote_id = self.get_metadata_note()
+        fields = {"model_fingerprints": json.dumps(fingerprints, sort_keys=True)}
+        self._anki_api.updateNoteFields(mnote_id, fields)
+
+        if self._metadata_fields is not None:
+            self._metadata_fields.model_fingerprints = fields["model_fingerprints"]
+
+    def check_models(self) -> bool:
+        """
+        checks our models in anki, but only those whose fingerprint differs
+        from the one stored in the metadata note. If nothing changed, this
+        costs a single read (none if the metadata is loaded already).
+
+        returns True if any model was checked
+        """
+        try:
+            stored = self.get_model_fingerprints()
+        except AssertionError:
+            # no metadata note (yet), check everything
+            stored = dict()
+
+        fingerprints = get_model_fingerprints()
+        # the metadata model comes first, it might lack the fingerprint field
+        outdated = [m for m in get_models() if stored.get(m.name) != fingerprints[m.name]]
+        if len(outdated) == 0:
+            logging.debug("models are up-to-date")
+            return False
+
+        model_names = self._anki_api.getModelNames()
+        for model in outdated:
+            logging.info(f"model: checking {model.name}")
+            self.check_model(model, model_names)
+
+        try:
+            self.set_model_fingerprints(fingerprints)
+        except AssertionError:
+            # create_deck stores them with the new metadata note
+            pass
+        return True
 
     def create_deck(self):
         """
@@ -60,20 +178,17 @@ class DeckBuilder:
         for t in SubjectTypes:
             self._anki_api.createDeck(self._get_anki_deck_name(t))
 
-        # create metadata card model, if not exists
-        self.check_model(get_model_metadata())
-
-        # create our card models for learning
-        self.check_model(RadicalSubject.get_model())
-        self.check_model(KanjiSubject.get_model())
-        self.check_model(VocabSubject.get_model())
+        # create the metadata and our learning card models or update them
+        self.check_models()
 
         # create hidden card with model or update it
         try:
             id = self.get_metadata_note()
         except AssertionError:
             logging.debug("Creating metadata card")
-            metadata_note = get_note_metadata(self._get_anki_deck_name(), fields=MetadataFields(0))
+            metadata_note = get_note_metadata(self._get_anki_deck_name(), fields=MetadataFields(
+                0, 0, json.dumps(get_model_fingerprints(), sort_keys=True)
+            ))
             id = self._anki_api.addNote(AnkiConnect.NewNote(metadata_note))
 
         note_info = self._anki_api.getNotesInfo(notes_id=[id])[0]
@@ -84,12 +199,15 @@ class DeckBuilder:
         # we are done
         logging.info(f"Successfully created deck {self._get_anki_deck_name()}")
 
-    def check_model(self, model: Model):
+    def check_model(self, model: Model, model_names: list[str] | None = None):
         """check if models are up-to-date
         this means in regards to their fields,
         their templates and their styling
         """
-        if model.name in self._anki_api.getModelNames():
+        if model_names is None:
+            model_names = self._anki_api.getModelNames()
+
+        if model.name in model_names:
             # update fields (if missing)
             model_fields = self._anki_api.getModelFieldNames(model.name)
 
@@ -161,68 +279,206 @@ class DeckBuilder:
         logging.warning(f"Inserting {len(unkonwn_notes)} new notes")
 
         if add_individually:
-            new_note_ids = []
-            for un in unkonwn_notes:
-                new_note_ids.append(self._anki_api.addNote(un))
+            # each note is its own action, errors are reported per sub_id
+            with self._anki_api.batch() as batch:
+                for un in unkonwn_notes:
+                    self._anki_api.addNote(un, batch=batch, tag=un.note.fields.sub_id)
+                try:
+                    new_note_ids = batch.flush()
+                except BatchError as e:
+                    # the other notes were added, report the rejected ones like _insert_chunked
+                    new_note_ids = e.results
+                    for sub_id, error in e.errors:
+                        logging.error(f"Anki rejected note of subject {sub_id}: {error}")
+                        self.rejected_notes.append((int(sub_id), str(error)))
         else:
-            new_note_ids = self._anki_api.addNotes(unkonwn_notes)
+            new_note_ids = self._insert_chunked(unkonwn_notes)
+
+        new_note_ids = [id for id in new_note_ids if id is not None]
+        self._load_new_notes(new_note_ids)
 
-        logging.warning(f"Updating {len(update_notes)} notes")
-        for id, note in update_notes:
-            self._anki_api.updateNoteFields(id, note.note.fields)
+        self.update_notes([(id, note.note) for id, note in update_notes])
 
         return new_note_ids
 
+    def _insert_chunked(self, new_notes: list[AnkiConnect.NewNote]) -> list[int]:
+        """inserts notes with addNotes in chunks, the chunk size is adapted to the
+        measured latency. Failing chunks are bisected to isolate the bad notes,
+        which are collected in rejected_notes"""
+        note_ids = []
+        size = max(1, self._insert_chunk_size)
+
+        pos = 0
+        while pos < len(new_notes):
+            chunk = new_notes[pos:pos + size]
+            pos += len(chunk)
+
+            start = time.monotonic()
+            note_ids.extend(self._insert_bisect(chunk))
+            duration = time.monotonic() - start
+
+            # scale chunk to our target latency (but grow slowly)
+            size = int(min(2 * size, max(1, size * self._insert_target_s / max(duration, 1e-3))))
+            logging.info(f"Inserted {pos}/{len(new_notes)} notes (next chunk size {size})")
+
+        # keep the adapted size for the next call (e.g. the next batch of the pipeline)
+        self._insert_chunk_size = size
+        return note_ids
+
+    def _insert_bisect(self, notes: list[AnkiConnect.NewNote]) -> list[int]:
+        try:
+            return self._anki_api.addNotes(notes)
+        except Exception as e:
+            # anki keeps the good notes of a failed call, sending them again
+            # would fail as duplicates. Only the remaining ones are bisected
+            added = self._find_added_notes(notes)
+            remaining = [n for n in notes if int(n.note.fields.sub_id) not in added]
+            note_ids = list(added.values())
+
+            if len(remaining) > 1:
+                logging.info(f"Inserting {len(remaining)} of {len(notes)} notes failed, bisecting")
+                mid = len(remaining) // 2
+                note_ids += self._insert_bisect(remaining[:mid]) + self._insert_bisect(remaining[mid:])
+            elif len(remaining) == 1:
+                sub_id = remaining[0].note.fields.sub_id
+                logging.error(f"Anki rejected note of subject {sub_id}: {e}")
+                self.rejected_notes.append((int(sub_id), str(e)))
+
+            return note_ids
+
+    def _find_added_notes(self, notes: list[AnkiConnect.NewNote]) -> dict[int, int]:
+        """note ids (by sub_id) of the given notes that are in the deck"""
+        sub_ids = " OR ".join(f'"sub_id:{n.note.fields.sub_id}"' for n in notes)
+        found = self._anki_api.getNotesInfo(
+            query=f'"deck:{self._get_anki_deck_name()}" ({sub_ids})', fields=SubjectBase.Fields, only=("sub_id",)
+        )
+        return {int(n.fields.sub_id): n.metadata.note_id for n in found if n.metadata is not None}
+
+    def _load_new_notes(self, note_ids: list[int]):
+        """add newly created notes (and their cards) to the snapshot"""
+        if len(note_ids) == 0:
+            return
+        if self._notes is None:
+            # nothing loaded yet, cards would be incomplete without the notes
+            self._cards = None
+            self._suspended = None
+            return
+
+        new_notes = []
+        for stype in SubjectTypes:
+            ids = self._anki_api.findNotes(
+                f'"deck:{self._get_anki_deck_name()}" "tag:{stype.name}" nid:{",".join(map(str, note_ids))}'
+            )
+            if len(ids) > 0:
+                new_notes.extend(self._anki_api.getNotesInfo(
+                    notes_id=ids, fields=stype.to_cls().Fields
+                ))
+
+        for note in new_notes:
+            assert note.metadata is not None
+            self._notes[note.metadata.note_id] = note
+
+        if self._cards is not None:
+            card_ids = [id for n in new_notes if n.metadata is not None for id in n.metadata.cards]
+            for card in self._anki_api.getCardsInfo(cards_id=card_ids, notes=self._notes):
+                self._cards[card.metadata.card_id] = card
+
+            if self._suspended is not None:
+                # new cards are never suspended
+                self._suspended.update({id: False for id in card_ids})
+
     def update_notes(self, notes: list[tuple[int, Note]]):
         logging.warning(f"Updating {len(notes)} notes")
 
-        for id, note in notes:
-            self._anki_api.updateNoteFields(id, note.fields)
+        with self._anki_api.batch() as batch:
+            for id, note in notes:
+                self._anki_api.updateNoteFields(id, note.fields, batch=batch)
+
+                # apply the change to our snapshot
+                if self._notes is not None and id in self._notes:
+                    self._notes[id].fields = note.fields
+                    for card_id in self._notes[id].metadata.cards:
+                        if self._cards is not None and card_id in self._cards:
+                            self._cards[card_id].fields = note.fields
 
     def insert_media(self, medias: list[dict]):
         """Insert a list of medias into the deck"""
         logging.warning(f"Adding {len(medias)} new media files (duplicates are overwritten)")
-        for media in medias:
-            self._anki_api.storeMediaFile(**media)
+        with self._anki_api.batch() as batch:
+            for media in medias:
+                self._anki_api.storeMediaFile(**media, batch=batch)
 
     def get_all_notes(self) -> list[Note[SubjectBase.Fields]]:
         """Get's all notes (and their details) from this deck from anki"""
-        notes = []
-        for stype in SubjectTypes:
-            ids = self._anki_api.findNotes(
-                f'"deck:{self._get_anki_deck_name()}" "tag:{stype.name}"'
-            )
+        if self._notes is None:
+            notes = []
+            for stype in SubjectTypes:
+                ids = self._anki_api.findNotes(
+                    f'"deck:{self._get_anki_deck_name()}" "tag:{stype.name}"'
+                )
+
+                notes.extend(self._anki_api.getNotesInfo(
+                    notes_id=ids, fields=stype.to_cls().Fields
+                ))
 
-            notes.extend(self._anki_api.getNotesInfo(
-                notes_id=ids, fields=stype.to_cls().Fields
-            ))
+            self._notes = {n.metadata.note_id: n for n in notes if n.metadata is not None}
 
-        return notes
+        return list(self._notes.values())
 
     def get_all_cards(self, *, get_all_metainfo: bool = True) -> list[Card]:
-        ids = self._anki_api.findCards(query=f'"deck:{self._get_anki_deck_name()}" -("note:{get_model_metadata().name}" card:1)')
-        cards = self._anki_api.getCardsInfo(cards_id=ids)
+        if self._cards is None:
+            # with metainfo, the notes are needed anyways. link them directly,
+            # so that the cards don't keep their own copy of the fields
+            if get_all_metainfo:
+                self.get_all_notes()
+
+            ids = self._anki_api.findCards(query=f'"deck:{self._get_anki_deck_name()}" -("note:{get_model_metadata().name}" card:1)')
+            # without notes, only the sub_id of the cards is needed
+            self._cards = {
+                c.metadata.card_id: c for c in self._anki_api.getCardsInfo(
+                    cards_id=ids, notes=self._notes, fields=SubjectBase.Fields, only=("sub_id",)
+                )
+            }
+
+        cards = list(self._cards.values())
 
         if get_all_metainfo:
             # get suspended state, as it is not in cardsInfo
-            sus_state = self._anki_api.areSuspended(ids)
+            if self._suspended is None:
+                self._suspended = self._anki_api.areSuspended(list(self._cards.keys()))
             # link corresponding notes
-            notes = {n.metadata.note_id: n for n in self.get_all_notes() if n.metadata is not None}
+            self.get_all_notes()
+            assert self._notes is not None
 
             for card in cards:
                 try:
-                    card.is_suspended = sus_state[card.metadata.card_id]
-                    card.note = notes[card.metadata.note_id]
+                    card.is_suspended = self._suspended[card.metadata.card_id]
+                    card.note = self._notes[card.metadata.note_id]
+                    card.fields = card.note.fields
                 except Exception as e:
                     raise Exception(f"Error processing card", card, e)
 
         return cards
 
+    def get_card_table(self) -> CardTable:
+        """all cards of the deck as columnar table (see CardTable)"""
+        return CardTable.from_cards(self.get_all_cards())
+
+    def _set_suspended(self, card_ids: list[int], state: bool):
+        if self._suspended is not None:
+            self._suspended.update({id: state for id in card_ids})
+        if self._cards is not None:
+            for id in card_ids:
+                if id in self._cards:
+                    self._cards[id].is_suspended = state
+
     def unsuspend(self, card_ids: list[int]):
         self._anki_api.unsuspend(card_ids)
+        self._set_suspended(card_ids, False)
 
     def suspend(self, card_ids: list[int]):
         self._anki_api.suspend(card_ids)
+        self._set_suspended(card_ids, True)
 
     def suspend_all(self):
         ids = self._anki_api.findCards(query=f'"deck:{self._get_anki_deck_name()}"')
@@ -232,20 +488,32 @@ class DeckBuilder:
         cards = self.get_all_cards(get_all_metainfo=False)
         card_ids = []
 
+        note_ids = set(note_ids)
         for card in cards:
             if card.metadata.note_id in note_ids:
                 card_ids.append(card.metadata.card_id)
 
-        self._anki_api.suspend(card_ids)
+        self.suspend(card_ids)
 
     def set_anki_due_from_subid(self, sub_with_due_d: dict[int, int], set_interval: bool = False):
         cards = self.get_all_cards(get_all_metainfo=False)
 
+        # there are only a handful of distinct days, so group the cards by them
+        cards_by_days: dict[int, list[int]] = dict()
         for card in cards:
-            date = sub_with_due_d.get(int(card.fields["sub_id"]["value"]))
+            date = sub_with_due_d.get(card.sub_id)
 
             if date is None:
                 continue
 
-            self._anki_api.setDueDate([card.metadata.card_id], date, set_interval)
+            cards_by_days.setdefault(date, []).append(card.metadata.card_id)
+
+        logging.info(f"Setting due dates of {sum(map(len, cards_by_days.values()))} cards in {len(cards_by_days)} groups")
+        with self._anki_api.batch() as batch:
+            for date, card_ids in sorted(cards_by_days.items()):
+                self._anki_api.setDueDate(card_ids, date, set_interval, batch=batch)
 
+                # apply the new interval to our snapshot
+                if set_interval and self._cards is not None:
+                    for id in card_ids:
+                        self._cards[id].interval = date
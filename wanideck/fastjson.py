@@ -0,0 +1,27 @@
+"""json backend for our http clients.
+
+orjson is used if it is installed, as decoding the large notesInfo /
+cardsInfo replies is a big part of a progress run. Otherwise the
+standard library json module is used.
+"""
+
+try:
+    import orjson
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads(data: bytes | str):
+        return orjson.loads(data)
+
+    BACKEND = "orjson"
+except ImportError:
+    import json
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+    def loads(data: bytes | str):
+        return json.loads(data)
+
+    BACKEND = "json"
@@ -0,0 +1,68 @@
+from typing import Iterable
+
+from .notes import Note
+
+class SubjectGraph:
+    """
+    Dependency graph of the subjects in our deck, keyed by sub_id.
+    Forward edges point to the requirements of a subject, reverse
+    edges to the subjects that require it (its follow ups).
+    """
+
+    def __init__(self) -> None:
+        self._requires: dict[int, set[int]] = dict()
+        self._required_by: dict[int, set[int]] = dict()
+
+    @classmethod
+    def from_notes(cls, notes: Iterable[Note]) -> "SubjectGraph":
+        graph = cls()
+        follow_ups: dict[int, list[int]] = dict()
+
+        for note in notes:
+            sub_id = int(note.fields.sub_id)
+            graph.add(sub_id, note.fields.requirements)
+            follow_ups[sub_id] = note.fields.follow_ups
+
+        # follow ups are the reverse of the requirements, wanikani should
+        # keep them consistent, but add the ones we know of anyways
+        for sub_id, ids in follow_ups.items():
+            for follow_up in ids:
+                if follow_up in graph:
+                    graph._requires[follow_up].add(sub_id)
+                    graph._required_by[sub_id].add(follow_up)
+
+        return graph
+
+    def add(self, sub_id: int, requirements: Iterable[int]):
+        self._requires.setdefault(sub_id, set()).update(requirements)
+        self._required_by.setdefault(sub_id, set())
+
+        for req in self._requires[sub_id]:
+            self._required_by.setdefault(req, set()).add(sub_id)
+
+    def __contains__(self, sub_id: int) -> bool:
+        return sub_id in self._requires
+
+    def __len__(self) -> int:
+        return len(self._requires)
+
+    def requirements(self, sub_id: int) -> set[int]:
+        return self._requires.get(sub_id, set())
+
+    def dependents(self, sub_ids: Iterable[int]) -> set[int]:
+        """subjects that directly require any of sub_ids"""
+        result = set()
+        for sub_id in sub_ids:
+            result.update(self._required_by.get(sub_id, ()))
+        return result & self._requires.keys()
+
+    def blocked_on(self, sub_id: int) -> set[int]:
+        """all subjects that (transitively) can't be unlocked before sub_id is learned"""
+        blocked = set()
+        todo = [sub_id]
+        while todo:
+            for dep in self.dependents([todo.pop()]):
+                if dep not in blocked:
+                    blocked.add(dep)
+                    todo.append(dep)
+        return blocked
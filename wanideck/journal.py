@@ -0,0 +1,86 @@
+import json
+import logging
+import dataclasses as ds
+from pathlib import Path
+
+logger = logging.getLogger("Journal")
+
+@ds.dataclass
+class RunJournal:
+    """
+    Checkpoints of an unfinished deck update. The deck timestamp is only
+    set after an update completed, so a failed run would start over. With
+    the journal, the next run starting from the same timestamp skips what
+    was already done: inserted subjects, stored media and finished steps.
+
+    Without a path (no cache dir) nothing is persisted.
+    """
+    deck: str
+    # deck timestamp the update started from
+    last_update_ts: int
+
+    # data_updated_at (by sub_id) of the subjects that were inserted or updated in
+    # anki. A subject that changed on wanikani since then has to be sent again
+    inserted: dict[int, str] = ds.field(default_factory=dict)
+    # subjects that were not in the deck before the update, their cards are
+    # suspended at the end. They are recorded before the insertion, as anki
+    # might add some notes of a failing request
+    new_sub_ids: set[int] = ds.field(default_factory=set)
+    # filenames of the stored medias
+    media: set[str] = ds.field(default_factory=set)
+    steps: set[str] = ds.field(default_factory=set)
+
+    path: Path | None = ds.field(default=None, compare=False, repr=False)
+
+    @classmethod
+    def open(cls, path: Path | None, deck: str, last_update_ts: int) -> "RunJournal":
+        """resumes the journal at path if it belongs to the same update, else starts a new one"""
+        journal = None
+        if path is not None and path.is_file():
+            try:
+                data = json.loads(path.read_text())
+                journal = cls(
+                    deck=data["deck"], last_update_ts=data["last_update_ts"],
+                    inserted={int(k): v for k, v in data["inserted"].items()}, new_sub_ids=set(data["new_sub_ids"]),
+                    media=set(data["media"]), steps=set(data["steps"]), path=path
+                )
+            except Exception as e:
+                logger.warning(f"Could not load run journal {path}: {e}")
+
+        if journal is not None and (journal.deck, journal.last_update_ts) == (deck, last_update_ts):
+            logger.warning(
+                f"Resuming previous update ({len(journal.inserted)} subjects, {len(journal.media)} media "
+                f"and steps {sorted(journal.steps)} are done)"
+            )
+            return journal
+
+        return cls(deck=deck, last_update_ts=last_update_ts, path=path)
+
+    def save(self):
+        if self.path is None:
+            return
+
+        # replace the journal at once, so that an interruption can't leave a broken one
+        tmp_file = self.path.with_name(self.path.name + ".part")
+        tmp_file.write_text(json.dumps(dict(
+            deck=self.deck, last_update_ts=self.last_update_ts,
+            inserted=self.inserted, new_sub_ids=sorted(self.new_sub_ids),
+            media=sorted(self.media), steps=sorted(self.steps)
+        )))
+        tmp_file.replace(self.path)
+
+    def is_inserted(self, sub_id: int, data_updated_at: str) -> bool:
+        """the subject is in anki with this version of its data"""
+        return self.inserted.get(sub_id) == data_updated_at
+
+    def is_done(self, step: str) -> bool:
+        return step in self.steps
+
+    def done(self, step: str):
+        self.steps.add(step)
+        self.save()
+
+    def remove(self):
+        """the update is complete (or has to start over)"""
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
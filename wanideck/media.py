@@ -0,0 +1,123 @@
+import json
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from . import profiling
+from .session import create_session
+
+logger = logging.getLogger("Media")
+
+class MediaFetcher:
+    """
+    Downloads media (audio, svgs, ...) from the wanikani cdn into
+    our cache dir. Downloads are done by a bounded pool of workers,
+    as the cdn is neither rate limited nor requires authorization,
+    it is handled seperately from the api client.
+    """
+
+    def __init__(
+            self, cache_dir: Path, concurrency: int = 8, timeout: float | None = None,
+            keep_alive: bool = True
+        ) -> None:
+        self._cache_dir = cache_dir
+        self._concurrency = max(1, concurrency)
+        self._timeout = timeout
+        self._session = create_session(self._concurrency, keep_alive)
+
+    def cache_path(self, media: dict) -> Path:
+        return self._cache_dir / media["filename"]
+
+    def _download(self, media: dict) -> Path:
+        media_file = self.cache_path(media)
+
+        logger.debug(f"downloading {media['url']}")
+        start = time.perf_counter()
+        r = self._session.get(media["url"], timeout=self._timeout)
+        profiling.record_request("media", "download", time.perf_counter() - start, received=len(r.content))
+        r.raise_for_status()
+
+        # write to a temporary file first, so that an interrupted
+        # download doesn't leave a broken file in the cache
+        tmp_file = media_file.with_name(media_file.name + ".part")
+        tmp_file.write_bytes(r.content)
+        tmp_file.replace(media_file)
+
+        return media_file
+
+    def fetch_all(self, medias: list[dict]) -> list[Path]:
+        """makes sure all medias exist in the cache dir, downloads
+        missing ones concurrently and returns their cache paths"""
+        if not self._cache_dir.is_dir():
+            logger.fatal(f"Invalid cache dir {self._cache_dir}. please make sure I can write/read from the folder")
+            raise Exception("Invalid cache dir")
+
+        # a media might be requested multiple times, only download it once
+        missing = {}
+        for media in medias:
+            if not self.cache_path(media).is_file():
+                missing.setdefault(media["filename"], media)
+
+        if len(missing) > 0:
+            logger.info(f"Downloading {len(missing)} missing media files ({self._concurrency} workers)")
+
+            done = 0
+            with ThreadPoolExecutor(max_workers=self._concurrency) as pool:
+                futures = [pool.submit(self._download, m) for m in missing.values()]
+
+                for future in as_completed(futures):
+                    # propagates the download error (if one occurred)
+                    future.result()
+
+                    done += 1
+                    if done % 100 == 0 or done == len(missing):
+                        logger.info(f"media: downloaded {done}/{len(missing)}")
+
+        return [self.cache_path(media) for media in medias]
+
+
+class MediaManifest:
+    """
+    Remembers the content hash of every media file that was uploaded
+    to anki, so that unchanged files don't have to be uploaded again.
+
+    The hashes of our cached files are kept by their size and mtime, so
+    that unchanged files don't have to be read to tell they are unchanged.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._hashes: dict[str, str] = dict()
+        # filename -> [size, mtime_ns, digest]
+        self._files: dict[str, list] = dict()
+
+        if path.is_file():
+            data = json.loads(path.read_text())
+            self._hashes = data["uploaded"]
+            self._files = data["files"]
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def file_digest(self, path: Path) -> str:
+        """digest of the file, only read if it changed since it was last hashed"""
+        stat = path.stat()
+        cached = self._files.get(path.name)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+
+        digest = self.digest(path.read_bytes())
+        self._files[path.name] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def is_uploaded(self, filename: str, digest: str) -> bool:
+        return self._hashes.get(filename) == digest
+
+    def set_uploaded(self, filename: str, digest: str):
+        self._hashes[filename] = digest
+
+    def save(self):
+        self._path.write_text(json.dumps(dict(uploaded=self._hashes, files=self._files), indent=1, sort_keys=True))
@@ -1,9 +1,16 @@
-from dataclasses import dataclass, fields
-from functools import cache
+import hashlib
+import json
+from dataclasses import asdict, dataclass, fields
+from functools import cache, cached_property
 from pathlib import Path
 
 RES_FOLDER = Path(__file__).parent / "../res/"
 
+@cache
+def read_resource(name: str) -> str:
+    """resource files (templates, css) are only read once"""
+    return (RES_FOLDER / name).read_text()
+
 @dataclass(frozen=True)
 class CardTemplate:
     Name: str
@@ -19,6 +26,15 @@ class Model():
     css: None | str = None
     isCloze: bool = False
 
+    @cached_property
+    def fingerprint(self) -> str:
+        """hash of everything that defines the model in anki"""
+        data = json.dumps(dict(
+            name=self.name, fields=self.fields, templates=[asdict(t) for t in self.templates],
+            css=self.css, isCloze=self.isCloze
+        ), sort_keys=True)
+        return hashlib.sha1(data.encode()).hexdigest()
+
 def get_field_list(ds):
     """get the list of all fields. kw_only fields come afterwards"""
     std_fields = [f.name for f in fields(ds) if not f.kw_only]
@@ -48,3 +64,11 @@ def get_model_metadata():
         templates=[get_temp_hidden()]
     )
 
+
+def get_models() -> list[Model]:
+    """all our models, the metadata model first"""
+    from .subjects import SubjectTypes
+    return [get_model_metadata()] + [t.to_cls().get_model() for t in SubjectTypes]
+
+def get_model_fingerprints() -> dict[str, str]:
+    return {m.name: m.fingerprint for m in get_models()}
@@ -1,45 +1,66 @@
-from dataclasses import dataclass, field, fields
+import json
+from array import array
+from dataclasses import MISSING, dataclass, field, fields
 from enum import Enum
-from typing import Generic, TypeVar
+from functools import cache
+from typing import Callable, Generic, TypeVar
 
-@dataclass
+@dataclass(slots=True)
 class Fields:
     def to_dict(self) -> dict:
         d = {}
 
         for f in fields(self):
-            d[f.name] = str(getattr(self, f.name))
+            value = getattr(self, f.name)
+            if isinstance(value, array):
+                # same representation as a list of ints
+                value = json.dumps(value.tolist())
+            d[f.name] = str(value)
 
         return d
 
     @classmethod
     def from_dict(cls, data) -> "Fields":
-        _datal = list(data.items())
-        _datal.sort(key=lambda e: e[1]["order"])
+        return cls.decoder()(data)
 
-        _data = {e[0]: e[1]["value"] for e in _datal}
-
-        return cls(**_data)
-
-@dataclass
+    @classmethod
+    def decoder(cls, only: tuple[str, ...] | None = None) -> Callable[[dict], "Fields"]:
+        """get a decoder from anki-connects field layout ({name: {value, order}})
+        to this class. If only is given, just these fields are read and the
+        others are set to None. Decoders are built once per class and only"""
+        return _build_decoder(cls, only)
+
+@cache
+def _build_decoder(cls: type, only: tuple[str, ...] | None) -> Callable[[dict], Fields]:
+    # the field names are resolved once, not per note
+    names = [f.name for f in fields(cls) if only is None or f.name in only]
+    skipped = {f.name: None for f in fields(cls) if f.name not in names}
+    # fields with a default were added later, older notes might miss them
+    defaults = {f.name: f.default for f in fields(cls) if f.name in names and f.default is not MISSING}
+
+    if len(defaults) == 0:
+        return lambda d: cls(**skipped, **{n: d[n]["value"] for n in names})
+    return lambda d: cls(**skipped, **{n: d[n]["value"] if n in d else defaults[n] for n in names})
+
+@dataclass(slots=True)
 class NoteOptions:
     allowDuplicate: bool = False
     duplicateScope: str = "deck"
     duplicateScopeOptions: dict = field(default_factory=dict)
 
-@dataclass
+@dataclass(slots=True)
 class NoteMetadata:
     mod: int
     cards: list[int]
     profile: str
     note_id: int
 
-@dataclass
+@dataclass(slots=True)
 class CardMetadata:
     card_id: int
     note_id: int
 
-@dataclass
+@dataclass(slots=True)
 class CardMemoryState:
     """FSRS memory state for a card"""
     stability: float
@@ -47,7 +68,7 @@ class CardMemoryState:
 
 T = TypeVar("T", bound=Fields)
 
-@dataclass
+@dataclass(slots=True)
 class Note(Generic[T]):
     deck: str | None
     model: str
@@ -65,7 +86,7 @@ class Note(Generic[T]):
             return None
         return int(level_tag[0][len("level"):])
 
-@dataclass
+@dataclass(slots=True)
 class Card(Generic[T]):
     deck: str
     model: str
@@ -77,11 +98,20 @@ class Card(Generic[T]):
     memory_state: CardMemoryState | None
     interval: int
 
+    @property
+    def sub_id(self) -> int:
+        # fields are either the raw anki-connect dict or the ones of its note
+        if isinstance(self.fields, dict):
+            return int(self.fields["sub_id"]["value"])
+        return int(getattr(self.fields, "sub_id"))
+
 
-@dataclass
+@dataclass(slots=True)
 class MetadataFields(Fields):
     last_updated_deck: str
     last_updated_status: str
+    # json of {model name: fingerprint} of the models in anki
+    model_fingerprints: str = ""
 
     class Types(Enum):
         DECK = "last_updated_deck"
@@ -0,0 +1,114 @@
+import logging
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator
+
+from . import profiling
+
+logger = logging.getLogger("Pipeline")
+
+class _End:
+    """marks the end of the items in a queue"""
+
+class _Failure:
+    """passed downstream instead of items if a stage failed"""
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+
+class Pipeline:
+    """
+    Streams items from a source through a chain of stages. The source and
+    each stage run in their own thread and are connected by bounded queues,
+    so they work at the same time and a slow stage holds back the ones before
+    it (instead of them piling up items in memory).
+
+    The results of the last stage are consumed by iterating the pipeline. An
+    error in any stage stops the pipeline and is raised by the iteration.
+
+        for result in Pipeline(pages).stage(parse, "parse").stage(fetch, "fetch"):
+            ...
+    """
+
+    def __init__(self, source: Iterable, maxsize: int = 2) -> None:
+        self._source = source
+        self._maxsize = maxsize
+        self._stages: list[tuple[str, Callable[[Any], Any]]] = []
+        self._stop = threading.Event()
+
+    def stage(self, fn: Callable[[Any], Any], name: str) -> "Pipeline":
+        """appends a stage, fn is called with every item of the previous stage"""
+        self._stages.append((name, fn))
+        return self
+
+    def _put(self, q: queue.Queue, item: Any) -> bool:
+        """blocks until the item is queued, false if the pipeline was stopped"""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q: queue.Queue) -> Any:
+        """blocks until there is an item, _End if the pipeline was stopped"""
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _End()
+
+    def _run_source(self, out: queue.Queue):
+        try:
+            for item in self._source:
+                if not self._put(out, item):
+                    return
+            self._put(out, _End())
+        except BaseException as e:
+            self._put(out, _Failure(e))
+
+    def _run_stage(self, name: str, fn: Callable[[Any], Any], inp: queue.Queue, out: queue.Queue):
+        while True:
+            item = self._get(inp)
+            # errors and the end are passed on as is
+            if isinstance(item, (_End, _Failure)):
+                self._put(out, item)
+                return
+
+            try:
+                with profiling.span(name):
+                    result = fn(item)
+            except BaseException as e:
+                logger.debug(f"stage {name} failed: {e}")
+                self._put(out, _Failure(e))
+                return
+
+            if not self._put(out, result):
+                return
+
+    def __iter__(self) -> Iterator:
+        queues = [queue.Queue(self._maxsize) for _ in range(len(self._stages) + 1)]
+
+        threads = [threading.Thread(target=self._run_source, args=(queues[0],), daemon=True, name="pipeline-source")]
+        for i, (name, fn) in enumerate(self._stages):
+            threads.append(threading.Thread(
+                target=self._run_stage, args=(name, fn, queues[i], queues[i + 1]),
+                daemon=True, name=f"pipeline-{name}"
+            ))
+
+        for t in threads:
+            t.start()
+
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if isinstance(item, _End):
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            # also reached if the consumer stops early, the stages stop
+            # at their next item (the source after its current one)
+            self._stop.set()
@@ -0,0 +1,160 @@
+import cProfile
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+from typing import Callable, Iterator
+
+logger = logging.getLogger("Profile")
+
+class Profiler:
+    """
+    Collects timing spans of the phases of a run and statistics of all
+    requests (per client and action). Spans nest per thread, a span is
+    keyed by its path (e.g. update_cards_from_wk/insert notes).
+
+    cpu and memory additionally run cProfile (main thread only) and tracemalloc.
+    """
+
+    def __init__(self, cpu: bool = False, memory: bool = False) -> None:
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        # path -> [count, total_s]
+        self._phases: dict[str, list] = dict()
+        # client -> action -> [count, total_s, bytes sent, bytes received]
+        self._requests: dict[str, dict[str, list]] = dict()
+
+        self._cprofile = cProfile.Profile() if cpu else None
+        self._memory = memory
+        self._start = time.perf_counter()
+        self._wall_s: float | None = None
+
+    def start(self):
+        if self._memory:
+            tracemalloc.start()
+        if self._cprofile is not None:
+            self._cprofile.enable()
+        self._start = time.perf_counter()
+
+    def stop(self):
+        self._wall_s = time.perf_counter() - self._start
+        if self._cprofile is not None:
+            self._cprofile.disable()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(name)
+        path = "/".join(stack)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            with self._lock:
+                entry = self._phases.setdefault(path, [0, 0.0])
+                entry[0] += 1
+                entry[1] += duration
+
+    def record_request(self, client: str, action: str, duration: float, sent: int = 0, received: int = 0):
+        with self._lock:
+            entry = self._requests.setdefault(client, dict()).setdefault(action, [0, 0.0, 0, 0])
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] += sent
+            entry[3] += received
+
+    def _cprofile_summary(self, limit: int = 40) -> list[dict]:
+        assert self._cprofile is not None
+        stats = pstats.Stats(self._cprofile, stream=io.StringIO())
+
+        rows = []
+        for (file, line, func), (_, ncalls, tottime, cumtime, _) in stats.stats.items():  # type: ignore
+            rows.append(dict(
+                function=f"{file}:{line}({func})", ncalls=ncalls,
+                tottime_s=round(tottime, 4), cumtime_s=round(cumtime, 4),
+            ))
+        rows.sort(key=lambda r: -r["cumtime_s"])
+        return rows[:limit]
+
+    def _memory_summary(self, limit: int = 20) -> dict:
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics("lineno")[:limit]
+        tracemalloc.stop()
+
+        return dict(
+            current_mb=round(current / 2**20, 2), peak_mb=round(peak / 2**20, 2),
+            top=[dict(location=str(s.traceback), size_kb=round(s.size / 1024, 1), count=s.count) for s in top],
+        )
+
+    def report(self, **extra) -> dict:
+        """the collected statistics, extra is added as is"""
+        with self._lock:
+            report = dict(
+                wall_s=self._wall_s if self._wall_s is not None else time.perf_counter() - self._start,
+                phases={
+                    path: dict(count=count, total_s=round(total, 4))
+                    for path, (count, total) in sorted(self._phases.items())
+                },
+                requests={
+                    client: {
+                        action: dict(count=c, total_s=round(t, 4), bytes_sent=s, bytes_received=r)
+                        for action, (c, t, s, r) in sorted(actions.items(), key=lambda e: -e[1][1])
+                    } for client, actions in self._requests.items()
+                },
+            )
+        report.update(extra)
+
+        if self._cprofile is not None:
+            report["cprofile"] = self._cprofile_summary()
+        if self._memory:
+            report["memory"] = self._memory_summary()
+
+        return report
+
+    def write(self, path: Path, **extra):
+        path.write_text(json.dumps(self.report(**extra), indent=1))
+        logger.info(f"wrote profile to {path}")
+
+
+# the profiler of this run (if profiling is enabled)
+_active: Profiler | None = None
+
+def enable(cpu: bool = False, memory: bool = False) -> Profiler:
+    global _active
+    _active = Profiler(cpu, memory)
+    _active.start()
+    return _active
+
+def disable():
+    global _active
+    if _active is not None:
+        _active.stop()
+    _active = None
+
+def span(name: str):
+    """times the enclosed block, does nothing without an active profiler"""
+    if _active is None:
+        return nullcontext()
+    return _active.span(name)
+
+def traced(fn: Callable) -> Callable:
+    """decorator, runs the function in a span named after it"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with span(fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+def record_request(client: str, action: str, duration: float, sent: int = 0, received: int = 0):
+    if _active is not None:
+        _active.record_request(client, action, duration, sent, received)
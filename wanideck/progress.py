@@ -0,0 +1,129 @@
+import json
+import logging
+import dataclasses as ds
+from collections import Counter
+from pathlib import Path
+
+from .cardtable import CardTable
+from .notes import Card
+
+logger = logging.getLogger("Progress")
+
+@ds.dataclass
+class ProgressState:
+    """
+    The result of the last progress evaluation. It contains everything
+    the unlock algorithm needs, so that the next evaluation only has to
+    look at the cards that were reviewed since then.
+    """
+    deck: str
+    # id of the newest review that was considered
+    review_id: int
+    level: int
+
+    table: CardTable
+
+    # learned state of the subjects, derived from the table once and kept up-to-date
+    # by update_cards (not persisted). The count of not learned cards per subject
+    # tells if a subject became learned, without looking at its other cards
+    _stability_req_d: int | None = ds.field(default=None, init=False, repr=False, compare=False)
+    _unlearned: Counter[int] = ds.field(default_factory=Counter, init=False, repr=False, compare=False)
+    _learned: dict[int, bool] = ds.field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def learned_subjects(self, stability_req_d: int) -> dict[int, bool]:
+        """a subject is learned if all of its cards are learned"""
+        if self._stability_req_d != stability_req_d:
+            self._unlearned = self.table.unlearned_counts(stability_req_d)
+            self._learned = dict.fromkeys(self.table.sub_id, True)
+            self._learned.update(dict.fromkeys(self._unlearned, False))
+            self._stability_req_d = stability_req_d
+        return self._learned
+
+    def unlockable_by(self, newly_learned: set[int], learned: dict[int, bool]) -> set[int]:
+        """subjects that became unlockable, because newly_learned were learned.
+        A pass over the requirements is cheaper than building the graph for it"""
+        return {
+            sub_id for sub_id, reqs in self.table.requirements.items()
+            if not newly_learned.isdisjoint(reqs) and all(learned.get(req, False) for req in reqs)
+        }
+
+    def update_cards(self, cards: list[Card], stability_req_d: int) -> set[int]:
+        """update the learned state of (reviewed) cards,
+        returns the subjects that became learned through this"""
+        learned = self.learned_subjects(stability_req_d)
+
+        affected = set()
+        for sub_id, before, after in self.table.update_cards(cards, stability_req_d):
+            if before != after:
+                self._unlearned[sub_id] += 1 if before else -1
+                affected.add(sub_id)
+
+        newly_learned = set()
+        for sub_id in affected:
+            is_learned = self._unlearned[sub_id] == 0
+            if is_learned and not learned[sub_id]:
+                newly_learned.add(sub_id)
+            learned[sub_id] = is_learned
+        return newly_learned
+
+    def set_suspended(self, card_ids: list[int], suspended: bool):
+        self.table.set_suspended(card_ids, suspended)
+
+    def evaluate(self, stability_req_d: int, newly_learned: set[int] | None = None) -> list[int]:
+        """runs the unlock algorithm on the state (see WaniDeck.process_progress),
+        updates the level and returns the cards that should be unsuspended.
+
+        If newly_learned is given, the previous state was already evaluated and
+        only subjects that depend on newly_learned or reached through a level
+        up are considered"""
+        prev_level = self.level
+
+        # determine current level
+        level = self.table.current_level()
+
+        # mark learned subjects, all cards of a subject must be learned
+        learned_subs = self.learned_subjects(stability_req_d)
+
+        # check if next level
+        all_kanji_for_cur_level = self.table.kanji_cards_of_level(level)
+        learned_kanjis = list(filter(lambda id: learned_subs[id], all_kanji_for_cur_level))
+
+        logging.info(f"{len(learned_kanjis)}/{len(all_kanji_for_cur_level)} of level {level} are considered learned")
+        if len(learned_kanjis) >= len(all_kanji_for_cur_level) * 0.9:
+            level += 1
+            logging.info(f"with this a new level was archived ({level - 1} -> {level})")
+
+        self.level = level
+
+        # check requirements for all notes <= current level
+        candidates = None
+        if newly_learned is not None:
+            candidates = self.unlockable_by(newly_learned, learned_subs) if newly_learned else set()
+            if level > prev_level:
+                candidates |= self.table.subjects_of_levels(prev_level, level)
+
+        return self.table.unlockable_cards(level, learned_subs, candidates)
+
+    @classmethod
+    def load(cls, path: Path) -> "ProgressState | None":
+        if not path.is_file():
+            return None
+
+        try:
+            data = json.loads(path.read_text())
+            data["table"] = CardTable.from_dict(data["table"])
+            return cls(**data)
+        except Exception as e:
+            logger.warning(f"Could not load progress state {path}: {e}")
+            return None
+
+    def save(self, path: Path):
+        path.write_text(json.dumps(dict(
+            deck=self.deck, review_id=self.review_id, level=self.level,
+            table=self.table.to_dict()
+        )))
+
+    @staticmethod
+    def invalidate(path: Path):
+        """forces a full evaluation on the next run"""
+        path.unlink(missing_ok=True)
@@ -0,0 +1,71 @@
+import time
+import logging
+import threading
+from typing import Mapping
+
+logger = logging.getLogger("RateLimiter")
+
+class RateLimiter:
+    """
+    Token bucket that paces requests to the wanikani api. Tokens are
+    refilled with limit / window per second. On top of that, the
+    RateLimit-* headers of every response are used to never hand out
+    more tokens than the server allows in its current window.
+
+    A single limiter is shared by all threads using a client.
+    """
+
+    def __init__(self, limit: int = 60, window_s: float = 60, burst: int = 5) -> None:
+        self._lock = threading.Lock()
+        self._window_s = window_s
+        self._rate = limit / window_s
+        self._capacity = burst
+
+        self._tokens: float = burst
+        self._last = time.monotonic()
+
+        # total time spent waiting in acquire (over all threads)
+        self.waited_s: float = 0
+
+    def _refill(self, now: float):
+        self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def acquire(self) -> float:
+        """takes a token, blocks until one is available.
+        returns the time waited in seconds"""
+        with self._lock:
+            self._refill(time.monotonic())
+
+            # reserve the token, even if it isn't there yet. Multiple
+            # waiting threads are thereby queued one after the other
+            self._tokens -= 1
+            wait = max(0, -self._tokens / self._rate)
+            self.waited_s += wait
+
+        if wait > 0:
+            logger.debug(f"waiting {wait:.2f}s for rate limit")
+            time.sleep(wait)
+        return wait
+
+    def update(self, headers: Mapping[str, str]):
+        """adjust the bucket to the RateLimit-* headers of a response"""
+        try:
+            remaining = int(headers["RateLimit-Remaining"])
+            reset_ts = int(headers["RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return
+
+        with self._lock:
+            if "RateLimit-Limit" in headers:
+                self._rate = int(headers["RateLimit-Limit"]) / self._window_s
+
+            now = time.monotonic()
+            self._refill(now)
+
+            # reset is an epoch timestamp, compare it with the epoch and not local time
+            until_reset = max(0, reset_ts - time.time())
+
+            # the tokens refilled until the reset must not exceed what the server
+            # still allows us in this window
+            self._tokens = min(self._tokens, remaining - until_reset * self._rate)
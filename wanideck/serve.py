@@ -0,0 +1,116 @@
+import time
+import logging
+import dataclasses as ds
+from pathlib import Path
+from typing import Callable
+
+from .config import Config
+from .wanideck import WaniDeck
+
+logger = logging.getLogger("Serve")
+
+@ds.dataclass
+class _Task:
+    name: str
+    interval_s: float
+    fn: Callable[[], None]
+    next_run: float = 0
+
+class DeckServer:
+    """
+    Keeps a WaniDeck alive and runs its commands on their own cadences. The
+    notes, the subject graph and the progress state stay in memory between
+    runs, so that a progress check only costs a query for new reviews.
+
+    Progress also runs when the anki collection file changes (if configured).
+    """
+
+    def __init__(
+            self, wanideck: WaniDeck, config: Config,
+            should_suspend_new_cards: bool = True, insert_individually: bool = False, sync: bool = False
+        ) -> None:
+        self._wanideck = wanideck
+        self._poll_s = config.serve_poll_s
+        self._sync = sync
+
+        self._collection = None
+        if config.serve_collection_path:
+            self._collection = Path(config.serve_collection_path).expanduser()
+
+        # ordered, progress should see the changes of the others
+        self._tasks = [
+            _Task("update", config.serve_update_interval_s,
+                  lambda: wanideck.update_cards_from_wk(should_suspend_new_cards, insert_individually)),
+            _Task("syncuser", config.serve_syncuser_interval_s, wanideck.enter_wanikani_status_in_anki),
+            _Task("progress", config.serve_progress_interval_s, wanideck.process_progress),
+        ]
+        self._tasks = [t for t in self._tasks if t.interval_s > 0]
+
+        self._collection_mtime = self._get_collection_mtime()
+
+    def _get_collection_mtime(self) -> float | None:
+        if self._collection is None:
+            return None
+
+        # anki writes into the write ahead log first
+        mtimes = [
+            p.stat().st_mtime for p in [self._collection, self._collection.with_name(self._collection.name + "-wal")]
+            if p.exists()
+        ]
+        return max(mtimes, default=None)
+
+    def _collection_changed(self) -> bool:
+        mtime = self._get_collection_mtime()
+        changed = mtime != self._collection_mtime
+        self._collection_mtime = mtime
+        return changed
+
+    def run_pending(self, now: float) -> list[str]:
+        """runs the tasks that are due, returns their names"""
+        if self._collection_changed():
+            logger.info("anki collection changed")
+            for task in self._tasks:
+                if task.name == "progress":
+                    task.next_run = now
+
+        ran = []
+        for task in self._tasks:
+            if task.next_run > now:
+                continue
+            task.next_run = now + task.interval_s
+
+            logger.info(f"running {task.name}")
+            # reviews might have changed the cards since the last run
+            self._wanideck.refresh()
+            try:
+                task.fn()
+                ran.append(task.name)
+            except Exception as e:
+                # anki might be closed or wanikani unreachable, just try again next time
+                logger.error(f"{task.name} failed: {e}")
+                self._wanideck.invalidate()
+
+        if self._sync and len(ran) > 0:
+            try:
+                self._wanideck.do_webanki_sync()
+            except Exception as e:
+                logger.error(f"sync failed: {e}")
+
+        # our own changes shouldn't trigger another run
+        self._collection_mtime = self._get_collection_mtime()
+        return ran
+
+    def serve_forever(self):
+        logger.warning(
+            "serving " + ", ".join(f"{t.name} every {t.interval_s:.0f}s" for t in self._tasks)
+            + (f", progress on changes of {self._collection}" if self._collection is not None else "")
+        )
+
+        try:
+            while True:
+                self.run_pending(time.monotonic())
+
+                next_run = min((t.next_run for t in self._tasks), default=float("inf"))
+                time.sleep(max(0, min(self._poll_s, next_run - time.monotonic())))
+        except KeyboardInterrupt:
+            logger.warning("stopped serving")
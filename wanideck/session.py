@@ -0,0 +1,19 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+def create_session(pool_size: int = 10, keep_alive: bool = True) -> requests.Session:
+    """creates a session with a connection pool of pool_size connections.
+
+    The session is not modified after its creation, which makes it safe to
+    share between worker threads (the urllib3 pool itself is thread safe).
+    """
+    session = requests.Session()
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+
+    return session
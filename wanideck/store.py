@@ -0,0 +1,100 @@
+import json
+import sqlite3
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+logger = logging.getLogger("SubjectStore")
+
+class SubjectStore:
+    """
+    Local copy of the wanikani subjects, keyed by their subject id.
+    The store is kept up-to-date by merging in the subjects that were
+    updated since its last complete sync, so that a full deck can be
+    answered locally instead of paging through the whole subjects endpoint.
+
+    The pages of a sync are not ordered by their update time, so the
+    watermark is only set after a sync went through all of them.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        # the store is read by the pipeline in another thread than it was
+        # created in, but never by multiple threads at the same time
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS subjects (
+                id INTEGER PRIMARY KEY,
+                object TEXT NOT NULL,
+                level INTEGER NOT NULL,
+                hidden INTEGER NOT NULL,
+                data_updated_at TEXT NOT NULL,
+                updated_ts REAL NOT NULL,
+                subject TEXT NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+        self._db.commit()
+
+    @staticmethod
+    def _parse_ts(ts: str) -> float:
+        # python does not handle isoformat time with Z suffix correctly
+        return datetime.fromisoformat(ts.replace("Z", "+00:00")).timestamp()
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT count(*) FROM subjects").fetchone()[0]
+
+    @property
+    def synced_until(self) -> str | None:
+        """the store has all subjects updated until this data_updated_at,
+        None if there was no complete sync yet"""
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'synced_until'").fetchone()
+        return None if row is None else row[0]
+
+    def set_synced_until(self, updated_at: str):
+        """to be called after a sync merged all its pages"""
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES ('synced_until', ?)", (updated_at,))
+        self._db.commit()
+
+    def merge(self, subjects: list[dict]):
+        """inserts or replaces the given subjects"""
+        self._db.executemany(
+            "INSERT OR REPLACE INTO subjects VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(
+                s["id"],
+                s["object"],
+                s["data"]["level"],
+                s["data"].get("hidden_at") is not None,
+                s["data_updated_at"],
+                self._parse_ts(s["data_updated_at"]),
+                json.dumps(s),
+            ) for s in subjects]
+        )
+        self._db.commit()
+        logger.debug(f"merged {len(subjects)} subjects into store")
+
+    def iter(
+            self, last_update_ts: int | None = None, max_level: int | None = None,
+            page_size: int = 1000
+        ) -> Iterator[list[dict]]:
+        """yields all (not hidden) subjects that were updated after last_update_ts
+        and are below or equal max_level in pages of page_size"""
+        query = "SELECT subject FROM subjects WHERE hidden = 0"
+        params = []
+        if last_update_ts is not None:
+            query += " AND updated_ts > ?"
+            params.append(last_update_ts)
+        if max_level is not None:
+            query += " AND level <= ?"
+            params.append(max_level)
+        query += " ORDER BY id"
+
+        cursor = self._db.execute(query, params)
+        while rows := cursor.fetchmany(page_size):
+            yield [json.loads(row[0]) for row in rows]
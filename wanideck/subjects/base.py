@@ -3,6 +3,7 @@ import dataclasses as ds
 from typing import Callable, Generic, TypeVar, Any
 import json
 import logging
+from array import array
 
 from .types import SubjectTypes
 
@@ -12,16 +13,32 @@ from ..config import Config
 
 logger = logging.getLogger("Subjects")
 
-@ds.dataclass
+@ds.dataclass(slots=True)
 class SFields(Fields):
     """generall fields that should be supported in subjects"""
     _: ds.KW_ONLY
     lesson_pos: int
-    follow_up_ids: list[int] | str
-    requirement_ids: list[int] | str
+    follow_up_ids: array | list[int] | str
+    requirement_ids: array | list[int] | str
     sub_id: int
     url: str
 
+    def __post_init__(self):
+        # keep id lists parsed as compact integer arrays
+        self.follow_up_ids = self._to_id_array(self.follow_up_ids)
+        self.requirement_ids = self._to_id_array(self.requirement_ids)
+
+    @staticmethod
+    def _to_id_array(ids: array | list[int] | str | None) -> array:
+        if isinstance(ids, array):
+            return ids
+        if ids is None:
+            # field was not decoded
+            return array("l")
+        if isinstance(ids, str):
+            ids = json.loads(ids) if ids.strip() else []
+        return array("l", ids)
+
     @classmethod
     def uniq_name_from_sub(cls, subject: dict) -> str:
         return f"{subject['object']}_{subject['data']['slug']}"
@@ -86,11 +103,12 @@ class SFields(Fields):
         return ", ".join(syms), ", ".join(sym_names)
 
     @property
-    def requirements(self) -> list[int]:
-        if isinstance(self.requirement_ids, list):
-            return self.requirement_ids
-        else:
-            return json.loads(self.requirement_ids)
+    def requirements(self) -> array:
+        return self._to_id_array(self.requirement_ids)
+
+    @property
+    def follow_ups(self) -> array:
+        return self._to_id_array(self.follow_up_ids)
 
 TFields = TypeVar("TFields", bound="SFields")
 
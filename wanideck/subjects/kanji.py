@@ -1,7 +1,7 @@
 from typing import Callable
 import dataclasses as ds
 
-from ..models import RES_FOLDER, CardTemplate, Model, get_field_list
+from ..models import CardTemplate, Model, get_field_list, read_resource
 from ..notes import Note
 from ..config import Config
 
@@ -9,7 +9,7 @@ from .types import SubjectTypes
 
 from .base import SFields, SubjectBase, mcache
 
-@ds.dataclass
+@ds.dataclass(slots=True)
 class KFields(SFields):
     kanji: str
     kanji_meaning: str
@@ -42,7 +42,7 @@ class KFields(SFields):
         params["reading_mnemonic"] = subject["data"]["reading_mnemonic"]
         params["reading_hint"] = subject["data"]["reading_hint"]
 
-        params.update(ds.asdict(super().from_subject(subject)))
+        params.update(ds.asdict(super(KFields, cls).from_subject(subject)))
 
         return cls(**params)
 
@@ -68,8 +68,8 @@ class KanjiSubject(SubjectBase):
     def get_temp_recognition(cls):
         return CardTemplate(
             Name = "Recognition",
-            Front = (RES_FOLDER / "html/kanji Model_Recognition_f.html").read_text(),
-            Back = (RES_FOLDER / "html/kanji Model_Recognition_b.html").read_text(),
+            Front = read_resource("html/kanji Model_Recognition_f.html"),
+            Back = read_resource("html/kanji Model_Recognition_b.html"),
         )
 
     @classmethod
@@ -77,8 +77,8 @@ class KanjiSubject(SubjectBase):
     def get_temp_reading(cls):
         return CardTemplate(
             Name = "Reading",
-            Front = (RES_FOLDER / "html/kanji Model_Reading_f.html").read_text(),
-            Back = (RES_FOLDER / "html/kanji Model_Reading_b.html").read_text(),
+            Front = read_resource("html/kanji Model_Reading_f.html"),
+            Back = read_resource("html/kanji Model_Reading_b.html"),
         )
 
     @classmethod
@@ -88,7 +88,7 @@ class KanjiSubject(SubjectBase):
             name="Kanji Model - wanideck",
             fields=get_field_list(cls.Fields),
             templates=[cls.get_temp_recognition(), cls.get_temp_reading()],
-            css = (RES_FOLDER / "html/main.css").read_text()
+            css = read_resource("html/main.css")
         )
 
     @classmethod
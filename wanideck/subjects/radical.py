@@ -3,13 +3,13 @@ import dataclasses as ds
 
 from ..config import Config
 
-from ..models import RES_FOLDER, CardTemplate, Model, get_field_list
+from ..models import CardTemplate, Model, get_field_list, read_resource
 from ..notes import Note
 
 from .base import SFields, SubjectBase, mcache
 from .types import SubjectTypes
 
-@ds.dataclass
+@ds.dataclass(slots=True)
 class RFields(SFields):
     radical_name: str
     radical: str
@@ -31,7 +31,7 @@ class RFields(SFields):
 
         params["radical_meaning"] = subject["data"]["meaning_mnemonic"]
 
-        params.update(ds.asdict(super().from_subject(subject)))
+        params.update(ds.asdict(super(RFields, cls).from_subject(subject)))
 
         return cls(**params)
 
@@ -47,8 +47,8 @@ class RadicalSubject(SubjectBase):
     def get_temp_recognition(cls):
         return CardTemplate(
             Name = "Recognition",
-            Front = (RES_FOLDER / "html/radical Model_Recognition_f.html").read_text(),
-            Back = (RES_FOLDER / "html/radical Model_Recognition_b.html").read_text(),
+            Front = read_resource("html/radical Model_Recognition_f.html"),
+            Back = read_resource("html/radical Model_Recognition_b.html"),
         )
 
     @classmethod
@@ -58,7 +58,7 @@ class RadicalSubject(SubjectBase):
             name="Radical Model - wanideck",
             fields=get_field_list(cls.Fields),
             templates=[cls.get_temp_recognition()],
-            css = (RES_FOLDER / "html/main.css").read_text()
+            css = read_resource("html/main.css")
         )
 
     @classmethod
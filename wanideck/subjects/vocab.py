@@ -1,14 +1,14 @@
 from typing import Callable
 import dataclasses as ds
 
-from ..models import RES_FOLDER, CardTemplate, Model, get_field_list
+from ..models import CardTemplate, Model, get_field_list, read_resource
 from ..notes import Note
 from ..config import Config
 
 from .types import SubjectTypes
 from .base import SFields, SubjectBase, mcache, logger
 
-@ds.dataclass
+@ds.dataclass(slots=True)
 class VFields(SFields):
     vocab: str
     vocab_meaning: str
@@ -67,7 +67,7 @@ class VFields(SFields):
         params["audio_m"] = f"[sound:{params['vocab']}_m.webm]"
         params["audio_f"] = f"[sound:{params['vocab']}_f.webm]"
 
-        params.update(ds.asdict(super().from_subject(subject)))
+        params.update(ds.asdict(super(VFields, cls).from_subject(subject)))
         return cls(**params)
 
     def crossreference(self, cards_by_sub: dict[int, Note["SFields"]]) -> bool:
@@ -92,8 +92,8 @@ class VocabSubject(SubjectBase):
     def get_temp_recognition(cls):
         return CardTemplate(
             Name = "Recognition",
-            Front = (RES_FOLDER / "html/vocab Model_Recognition_f.html").read_text(),
-            Back =  (RES_FOLDER / "html/vocab Model_Recognition_b.html").read_text()
+            Front = read_resource("html/vocab Model_Recognition_f.html"),
+            Back =  read_resource("html/vocab Model_Recognition_b.html")
         )
 
     @classmethod
@@ -101,8 +101,8 @@ class VocabSubject(SubjectBase):
     def get_temp_reading(cls):
         return CardTemplate(
             Name = "Reading",
-            Front = (RES_FOLDER / "html/vocab Model_Reading_f.html").read_text(),
-            Back =  (RES_FOLDER / "html/vocab Model_Reading_b.html").read_text()
+            Front = read_resource("html/vocab Model_Reading_f.html"),
+            Back =  read_resource("html/vocab Model_Reading_b.html")
         )
 
     @classmethod
@@ -112,7 +112,7 @@ class VocabSubject(SubjectBase):
             name="Vocab Model - wanideck",
             fields=get_field_list(cls.Fields),
             templates=[cls.get_temp_recognition(), cls.get_temp_reading()],
-            css = (RES_FOLDER / "html/main.css").read_text()
+            css = read_resource("html/main.css")
         )
 
     @classmethod
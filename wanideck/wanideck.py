@@ -1,106 +1,359 @@
 from base64 import b64encode
 import datetime
 import logging
+import json
+from pathlib import Path
 
-from .subjects import RadicalSubject, SubjectTypes, KanjiSubject, VocabSubject
+from .subjects import SubjectTypes
 from .deck import DeckBuilder
-from .notes import MetadataFields, Note
+from .notes import MetadataFields, Note, get_note_metadata
 from .config import Config
 from .wkapi import WaniKaniAPI
 from .ankiconnect import AnkiConnect
+from .media import MediaFetcher, MediaManifest
+from .store import SubjectStore
+from .session import create_session
+from .progress import ProgressState
+from .graph import SubjectGraph
+from .apkg import ApkgBuilder
+from .pipeline import Pipeline
+from .journal import RunJournal
+from . import profiling
 
 logger = logging.getLogger("WaniDeck")
 
 class WaniDeck:
+    # amount of subjects passed through the download pipeline at once
+    PIPELINE_BATCH_SIZE: int = 250
+
     def __init__(self, config: Config) -> None:
         self._config = config
-        self._wk_api = WaniKaniAPI(api_token=config.user_api_token)
-        self._anki_api = AnkiConnect()
-        self._deck = DeckBuilder(self._anki_api, self._config.deck_name)
+        # the subject store lives in the cache dir, go without it if there is none
+        store = None
+        if self._config.cache_dir.is_dir():
+            store = SubjectStore(self._config.cache_dir / "subjects.sqlite")
+        else:
+            logger.warning(f"cache dir {self._config.cache_dir} does not exist, subjects will not be stored locally")
+
+        self._wk_api = WaniKaniAPI(
+            api_token=config.user_api_token, store=store,
+            session=create_session(config.http_pool_size, config.http_keep_alive),
+            timeout=config.http_timeout_s,
+            partitions=config.wanikani_download_partitions,
+            base_url=config.wanikani_url
+        )
+        self._anki_api = AnkiConnect(
+            base_url=config.anki_url,
+            session=create_session(config.http_pool_size, config.http_keep_alive),
+            timeout=config.anki_timeout_s,
+            batch_size=config.anki_batch_size
+        )
+        self._deck = DeckBuilder(
+            self._anki_api, self._config.deck_name,
+            insert_chunk_size=config.anki_insert_chunk_size,
+            insert_target_s=config.anki_insert_target_s
+        )
+        self._media = MediaFetcher(
+            self._config.cache_dir, self._config.media_concurrency, timeout=config.http_timeout_s,
+            keep_alive=config.http_keep_alive
+        )
+
+        # the last progress evaluation, kept for processes that run multiple commands
+        self._progress_state: ProgressState | None = None
 
     def _update_metadata(self, last_update:int):
         id = self._deck.get_metadata_note()
         self._anki_api.updateNoteFields(id, dict(last_update=str(last_update)))
 
+    @profiling.traced
     def do_webanki_sync(self):
         self._anki_api.sync()
 
+    @profiling.traced
     def create_deck(self):
         self._deck.create_deck()
 
+    @profiling.traced
+    def check_models(self):
+        """updates our models in anki if they changed since they were last checked"""
+        if self._deck.check_models():
+            logger.warning("Updated the card models in anki")
+
+    @profiling.traced
     def update_cards_from_wk(self, should_suspend_new_cards: bool, insert_individually: bool):
         """
         This is for real now. Sync our cards from the WaniKani webpage
         """
         # get last update
         last_update_ts = self._deck.get_metadata_time(MetadataFields.Types.DECK)
+        # rejects of an earlier update (in the same process) are retried with this one
+        self._deck.rejected_notes.clear()
 
-        # make sure we consider subscription
-        max_level = self._wk_api.get_max_level()
+        # a previous run from the same timestamp might have been interrupted
+        journal = RunJournal.open(
+            self._config.cache_dir / "run_journal.json" if self._config.cache_dir.is_dir() else None,
+            self._config.deck_name, last_update_ts
+        )
+
+        new_notes: list[Note] = []
+        new_medias = []
+        # the notes are inserted batch by batch, while the next ones are downloaded and parsed
+        pipeline = self._note_pipeline(
+            last_update_ts, fetch_media=self._config.anki_media_transfer != Config.MediaTransfer.URL
+        )
+        for notes, medias, updated_at in pipeline:
+            new_notes.extend(notes)
+            new_medias.extend(medias)
+
+            # skip the subjects that are already in anki from an earlier try (unless they changed since)
+            notes = [n for n in notes if not journal.is_inserted(int(n.fields.sub_id), updated_at[int(n.fields.sub_id)])]
+            if len(notes) == 0:
+                continue
+
+            # the deck is about to change
+            self._invalidate_progress()
+
+            with profiling.span("insert notes"):
+                in_deck = {int(n.fields.sub_id) for n in self._deck.get_all_notes()}
+                journal.new_sub_ids.update(int(n.fields.sub_id) for n in notes if int(n.fields.sub_id) not in in_deck)
+                journal.save()
+
+                n_rejected = len(self._deck.rejected_notes)
+                self._deck.add_or_update_new_notes(notes, insert_individually)
 
-        # first off get all new subjects
-        subjects = self._wk_api.get_all_subjects(last_update_ts=last_update_ts, max_level=max_level)
+            rejected = {sub_id for sub_id, _ in self._deck.rejected_notes[n_rejected:]}
+            journal.inserted.update(
+                (int(n.fields.sub_id), updated_at[int(n.fields.sub_id)]) for n in notes
+                if int(n.fields.sub_id) not in rejected
+            )
+            journal.save()
 
-        logging.info(f"Downloaded {len(subjects)} new subjects after ts {last_update_ts}")
+        logging.info(f"Downloaded {len(new_notes)} new subjects after ts {last_update_ts}")
 
-        if len(subjects) == 0:
+        if len(new_notes) == 0:
+            journal.remove()
             return
 
-        new_notes: list[Note] = []
-        new_medias = []
-        # do postprocessing of subjects, this entails
-        # - retrieving missing files (like audio or images that represent the radical)
-        # - group subjects into categories
+        self._report_rejected()
+
+        self._upload_media(new_medias, journal)
+
+        if not journal.is_done("cross reference"):
+            with profiling.span("cross reference"):
+                ## create dict with sub_id idx for cross reference
+                all_notes = self._deck.get_all_notes()
+                notes_by_sub_id = {int(note.fields.sub_id): note for note in all_notes}
+
+                # only the added / changed subjects and the ones requiring them can change
+                updated_sub_ids = {int(note.fields.sub_id) for note in new_notes}
+                graph = SubjectGraph.from_notes(all_notes)
+                affected = (updated_sub_ids | graph.dependents(updated_sub_ids)) & notes_by_sub_id.keys()
+                logger.info(f"Cross referencing {len(affected)} notes")
+
+                changed_notes = []
+                # cross reference cards and look for changes
+                for sub_id in sorted(affected):
+                    note = notes_by_sub_id[sub_id]
+                    if note.fields.crossreference(notes_by_sub_id):
+                        assert note.metadata is not None, f"??? {note}"
+                        changed_notes.append((note.metadata.note_id, note))
+
+                self._deck.update_notes(changed_notes)
+            journal.done("cross reference")
+
+        # suspend all cards if required
+        if should_suspend_new_cards and not journal.is_done("suspend new"):
+            with profiling.span("suspend new"):
+                self._deck.suspend_cards_from_notes([
+                    n.metadata.note_id for n in self._deck.get_all_notes()
+                    if n.metadata is not None and int(n.fields.sub_id) in journal.new_sub_ids
+                ])
+            journal.done("suspend new")
+
+        # keep the old timestamp, so that rejected subjects are retried next time
+        if len(self._deck.rejected_notes) > 0:
+            logger.warning("Not updating the deck timestamp, as subjects were rejected")
+            # the retry has to cross reference and suspend again
+            journal.remove()
+            return
+
+        self._deck.set_metadata_time(MetadataFields.Types.DECK, datetime.datetime.now())
+        journal.remove()
+
+    def _parse_subjects(self, subjects: list[dict]) -> tuple[list[Note], list[dict], dict[int, str]]:
+        """parses a page of subjects into notes, the medias they need
+        and the data_updated_at of the subjects (by sub_id)"""
+        notes: list[Note] = []
+        page_medias = []
+        updated_at = {int(s["id"]): s["data_updated_at"] for s in subjects}
         for subject in subjects:
-            # retrieve missing audio
             for stype in SubjectTypes:
                 if subject["object"] == stype.object_name:
                     fn_note, medias = stype.to_cls().parse_wk_sub(subject, self._config)
 
                     # check if we need any media
                     if medias is not None:
-                        for media in medias:
-                            if not self._config.cache_dir.is_dir():
-                                logger.fatal(f"Invalid cache dir {self._config.cache_dir}. please make sure I can write/read from the folder")
-                                raise Exception("Invalid cache dir")
-
-                            media_file = self._config.cache_dir / media["filename"]
-                            if media_file.is_file():
-                                data: bytes = media_file.read_bytes()
-                            else:
-                                data: bytes = self._wk_api.download_resource(media["url"], False)
-                                media_file.write_bytes(data)
-
-                            media["data"] = b64encode(data).decode("ascii")
-                            new_medias.append(media)
-
-                    new_notes.append(
+                        page_medias.extend(medias)
+
+                    notes.append(
                         self._deck.complete_note(stype, fn_note)
                     )
+        return notes, page_medias, updated_at
+
+    def _note_pipeline(self, last_update_ts: int | None, fetch_media: bool) -> Pipeline:
+        """streams all subjects updated after last_update_ts in batches as
+        (notes, medias, data_updated_at by sub_id). The stages run concurrently, this entails
+        - downloading the subject pages
+        - group subjects into categories and parse them
+        - retrieving missing files (like audio or images that represent the radical)"""
+        # make sure we consider subscription
+        max_level = self._wk_api.get_max_level()
 
-        new_note_ids = self._deck.add_or_update_new_notes(new_notes, insert_individually)
+        def batches():
+            # pages are large, smaller batches let the stages overlap more
+            for page in self._wk_api.iter_all_subjects(last_update_ts=last_update_ts, max_level=max_level):
+                for i in range(0, len(page), self.PIPELINE_BATCH_SIZE):
+                    yield page[i:i + self.PIPELINE_BATCH_SIZE]
 
-        self._deck.insert_media(new_medias)
+        pipeline = Pipeline(batches())
+        pipeline.stage(self._parse_subjects, "parse subjects")
 
-        ## create dict with sub_id idx for cross reference
-        all_notes = self._deck.get_all_notes()
-        notes_by_sub_id = {int(note.fields.sub_id): note for note in all_notes}
+        if fetch_media:
+            def fetch(page: tuple[list[Note], list[dict], dict[int, str]]):
+                # retrieve missing media of this page (concurrently)
+                self._media.fetch_all(page[1])
+                return page
+            pipeline.stage(fetch, "download media")
 
-        changed_notes = []
-        # cross reference cards and look for changes
-        for note in all_notes:
-            if note.fields.crossreference(notes_by_sub_id):
-                assert note.metadata is not None, f"??? {note}"
-                changed_notes.append((note.metadata.note_id, note))
+        return pipeline
 
-        self._deck.update_notes(changed_notes)
+    def _download_notes(self, last_update_ts: int | None, fetch_media: bool) -> tuple[list[Note], list[dict]]:
+        """downloads all subjects updated after last_update_ts as notes
+        and the medias they need (into the cache dir if fetch_media)"""
+        new_notes: list[Note] = []
+        new_medias = []
+        for notes, medias, _ in self._note_pipeline(last_update_ts, fetch_media):
+            new_notes.extend(notes)
+            new_medias.extend(medias)
 
-        # suspend all cards if required
-        if should_suspend_new_cards:
-            self._deck.suspend_cards_from_notes(new_note_ids)
+        logging.info(f"Downloaded {len(new_notes)} new subjects after ts {last_update_ts}")
+        return new_notes, new_medias
 
-        self._deck.set_metadata_time(MetadataFields.Types.DECK, datetime.datetime.now())
+    @profiling.traced
+    def export_apkg(self, path: Path, should_suspend_new_cards: bool):
+        """
+        Builds the whole deck offline into an .apkg, that can be imported
+        into anki in one go. Anki doesn't need to run for this.
+
+        The notes are cross referenced and the metadata note is set up like
+        update_cards_from_wk would, so later runs only need the changes.
+        """
+        notes, medias = self._download_notes(None, fetch_media=True)
+
+        with profiling.span("cross reference"):
+            notes_by_sub_id = {int(note.fields.sub_id): note for note in notes}
+            for note in notes:
+                note.fields.crossreference(notes_by_sub_id)
+
+        # the deck in the package is new, our progress state would be for another one
+        self._invalidate_progress()
+
+        with profiling.span("build package"):
+            package = ApkgBuilder(self._config.deck_name)
+            package.add_note(get_note_metadata(
+                self._config.deck_name,
+                # without model fingerprints, as anki might keep its existing models
+                # on import. The next command checks (and stores) them
+                MetadataFields(str(int(datetime.datetime.now().timestamp())), "0")
+            ), key="metadata", suspended=True)
+
+            for note in notes:
+                package.add_note(note, key=int(note.fields.sub_id), suspended=should_suspend_new_cards)
+
+            package.add_media(self._media.fetch_all(medias))
+            package.write(path)
 
+        logger.warning(f"Wrote {len(notes)} notes to {path}, import it and run syncuser and progress afterwards")
+
+    def _report_rejected(self):
+        """write the subjects anki refused to add into the cache dir"""
+        report_file = self._config.cache_dir / "rejected_subjects.json"
+        rejected = self._deck.rejected_notes
+
+        if not self._config.cache_dir.is_dir():
+            if len(rejected) > 0:
+                logger.error(f"{len(rejected)} subjects were rejected by anki: {rejected}")
+            return
+
+        if len(rejected) == 0:
+            report_file.unlink(missing_ok=True)
+            return
+
+        logger.error(f"{len(rejected)} subjects were rejected by anki, see {report_file}")
+        report_file.write_text(json.dumps(
+            [dict(sub_id=sub_id, error=error) for sub_id, error in rejected], indent=1
+        ))
+
+    @profiling.traced
+    def _upload_media(self, medias: list[dict], journal: RunJournal | None = None):
+        """uploads medias to anki, files that anki already has with the
+        same content (according to our manifest) are skipped.
+
+        Depending on the media transfer mode, the files are either send
+        as data, as path into our cache dir or as cdn url.
+
+        The upload is done in chunks, after each the manifest (and journal)
+        are saved, so that an interrupted upload doesn't have to start over"""
+        medias = list({m["filename"]: m for m in medias}.values())
+        if journal is not None:
+            medias = [m for m in medias if m["filename"] not in journal.media]
+        if len(medias) == 0:
+            return
+
+        mode = self._config.anki_media_transfer
+        manifest = MediaManifest(self._config.cache_dir / "media_manifest.json")
+        in_anki = set(self._anki_api.getMediaFilesNames())
+
+        n_unchanged = 0
+        chunk_size = self._config.anki_batch_size
+        for i in range(0, len(medias), chunk_size):
+            uploads = []
+            for media in medias[i:i + chunk_size]:
+                media_file = self._media.cache_path(media)
+                if mode == Config.MediaTransfer.URL:
+                    # we don't have the content, but the cdn url changes with it
+                    digest = manifest.digest(media["url"].encode())
+                else:
+                    digest = manifest.file_digest(media_file)
+
+                if media["filename"] in in_anki and manifest.is_uploaded(media["filename"], digest):
+                    n_unchanged += 1
+                    continue
+
+                params = dict(filename=media["filename"])
+                if mode == Config.MediaTransfer.URL:
+                    params["url"] = media["url"]
+                elif mode == Config.MediaTransfer.PATH:
+                    params["path"] = str(media_file.resolve())
+                else:
+                    params["data"] = b64encode(media_file.read_bytes()).decode("ascii")
+
+                uploads.append((params, digest))
+
+            if len(uploads) > 0:
+                self._deck.insert_media([params for params, _ in uploads])
+
+            for params, digest in uploads:
+                manifest.set_uploaded(params["filename"], digest)
+            manifest.save()
+
+            if journal is not None:
+                journal.media.update(m["filename"] for m in medias[i:i + chunk_size])
+                journal.save()
+
+        logger.info(f"{n_unchanged} media files are unchanged in anki")
+
+    @profiling.traced
     def process_progress(self):
         """
         In this step your anki process is evaluated and new cards are
@@ -117,100 +370,98 @@ class WaniDeck:
             - a new level is reached if 90% of all kanjis of current level are considered "learned"
 
         This is not a perfect mapping, but it should be good enough.
-        """
-
-        # get all cards and their information
-        cards = self._deck.get_all_cards()
-
-        # determine current level
-        level = 1
-        for card in cards:
-            if card.note is None:
-                logging.warning(f"Note property of {card} was none, this should not be")
-                continue
-            if card.is_suspended:
-                continue
-            if RadicalSubject.get_type().name not in card.note.tags:
-                continue
-
-            if card.note.level is None:
-                raise ValueError("The note should have a level")
-
-            level = max(level, card.note.level)
-
-        # mark learned subjects (list of sub_ids)
-        ## as each subject has at least two cards and all must be learned, we
-        ## just iterate over all cards and use an & logic operation for sub_id
-        learned_subs: dict[int, bool] = dict()
 
-        for card in cards:
-            subject = int(card.fields["sub_id"]["value"])
+        The result of an evaluation is kept in the cache dir. The next run then
+        only looks at the cards reviewed since, if there were none it stops
+        after a single query. Commands that change the deck force a full run.
+        """
+        state_file = self._progress_state_file
+        stability_req_d = self._config.learning_stability_req_for_learned_d
+
+        state = self._progress_state or ProgressState.load(state_file)
+        if state is not None and state.deck != self._config.deck_name:
+            state = None
+
+        if state is None:
+            # get all cards and their information
+            review_id = self._deck.get_latest_review_id()
+            with profiling.span("load cards"):
+                table = self._deck.get_card_table()
+            state = ProgressState(
+                deck=self._config.deck_name, review_id=review_id, level=1, table=table
+            )
+            with profiling.span("evaluate"):
+                cards_to_unsuspend = state.evaluate(stability_req_d)
+        else:
+            review_id = self._deck.get_latest_review_id()
+            if review_id == state.review_id:
+                logger.info("No reviews since last progress evaluation")
+                return
+
+            with profiling.span("load reviewed cards"):
+                reviewed = self._deck.get_reviewed_cards(state.review_id)
+            logger.info(f"Reevaluating progress for {len(reviewed)} reviewed cards")
+            newly_learned = state.update_cards(reviewed, stability_req_d)
+            state.review_id = review_id
+
+            # only subjects affected by the newly learned ones can be unlocked now
+            with profiling.span("evaluate"):
+                cards_to_unsuspend = state.evaluate(stability_req_d, newly_learned)
 
-            is_learned = True
-            if card.memory_state is not None:
-                is_learned &= card.memory_state.stability >= self._config.learning_stability_req_for_learned_d
-            else:
-                is_learned &= card.interval >= self._config.learning_stability_req_for_learned_d
+        # unsuspend sleeping cards
+        self._deck.unsuspend(cards_to_unsuspend)
+        state.set_suspended(cards_to_unsuspend, False)
 
-            learned_subs[subject] = learned_subs.setdefault(subject, True) & is_learned
+        self._progress_state = state
+        if self._config.cache_dir.is_dir():
+            state.save(state_file)
 
-        # check if next level
-        all_kanji_for_cur_level: list[int] = []
-        for card in cards:
-            if card.note is None:
-                continue
-            if card.note.level != level:
-                continue
-            if KanjiSubject.get_type().name.lower() not in map(str.lower, card.note.tags):
-                continue
-            all_kanji_for_cur_level.append(int(card.fields["sub_id"]["value"]))
+    @property
+    def rate_limit_wait_s(self) -> float:
+        """time spent waiting for the wanikani rate limit"""
+        return self._wk_api.rate_limiter.waited_s
 
-        learned_kanjis = list(filter(lambda id: learned_subs[id], all_kanji_for_cur_level))
+    @property
+    def _progress_state_file(self) -> Path:
+        return self._config.cache_dir / "progress_state.json"
 
-        logging.info(f"{len(learned_kanjis)}/{len(all_kanji_for_cur_level)} of level {level} are considered learned")
-        if len(learned_kanjis) >= len(all_kanji_for_cur_level) * 0.9:
-            level += 1
-            logging.info(f"with this a new level was archived ({level - 1} -> {level})")
+    def _invalidate_progress(self):
+        """forces a full progress evaluation, after the deck was changed"""
+        self._progress_state = None
+        ProgressState.invalidate(self._progress_state_file)
 
-        # check requirements for all notes <= current level
-        notes = self._deck.get_all_notes()
-        cards_to_unsuspend = []
+    def refresh(self):
+        """drops the state of the cards, that changes with reviews in anki.
+        The notes are only changed by us and are kept"""
+        self._deck.invalidate(keep_notes=True)
 
-        for note in notes:
-            if note.level is None or note.level > level:
-                continue
-            if note.metadata is None:
-                logging.error(f"Note metadata is None - {note}")
-                continue
-
-            req_complete = all(map(lambda id: learned_subs[id], note.fields.requirements))
-            if req_complete:
-                cards_to_unsuspend.extend(note.metadata.cards)
-
-        # unsuspend sleeping cards
-        self._deck.unsuspend(cards_to_unsuspend)
+    def invalidate(self):
+        """drops everything kept in memory, e.g. after a command failed midway"""
+        self._deck.invalidate()
+        self._progress_state = None
 
+    @profiling.traced
     def enter_wanikani_status_in_anki(self):
         """WaniKani has assignemnts, which contain the sub_id and
         the current srs stage"""
         last_update_ts = self._deck.get_metadata_time(MetadataFields.Types.STATUS)
-        assignments = self._wk_api.get_all_assignments(last_update_ts)
-
-        logger.warning(f"Got {len(assignments)} assignments since {last_update_ts} epoch")
+        srs_mapping_to_days = [
+            0,
+            4/24, 8/24, 1, 2,  # apprentice
+            7, 14,  # guru
+            28,  # master
+            112,  # enlightend
+            182  # burned
+        ]
 
-        if len(assignments) > 0:
-            srs_mapping_to_days = [
-                0,
-                4/24, 8/24, 1, 2,  # apprentice
-                7, 14,  # guru
-                28,  # master
-                112,  # enlightend
-                182  # burned
-            ]
+        n_assignments = 0
+        sub_with_interval_and_due_d: dict[int, tuple[int, int]] = dict()
 
-            sub_with_interval_and_due_d: dict[int, tuple[int, int]] = dict()
+        cur_time = datetime.datetime.now(tz=datetime.timezone.utc)
 
-            cur_time = datetime.datetime.now(tz=datetime.timezone.utc)
+        # process the assignments page by page
+        for assignments in self._wk_api.iter_all_assignments(last_update_ts):
+            n_assignments += len(assignments)
 
             for assignment in assignments:
                 sub_id = assignment["data"]["subject_id"]
@@ -232,17 +483,25 @@ class WaniDeck:
 
                 sub_with_interval_and_due_d[sub_id] = (interval_d, due_in_d)
 
-            # set out intervals
-            self._deck.set_anki_due_from_subid(
-                    {id: v[0] for id, v in sub_with_interval_and_due_d.items()},
-                    set_interval=True
-            )
+        logger.warning(f"Got {n_assignments} assignments since {last_update_ts} epoch")
 
-            # schedule our cards
-            self._deck.set_anki_due_from_subid(
-                    {id: v[1] for id, v in sub_with_interval_and_due_d.items()},
-                    set_interval=False
-            )
+        if n_assignments > 0:
+            self._invalidate_progress()
 
-        self._deck.set_metadata_time(MetadataFields.Types.DECK, datetime.datetime.now())
+            with profiling.span("set due dates"):
+                # set out intervals
+                self._deck.set_anki_due_from_subid(
+                        {id: v[0] for id, v in sub_with_interval_and_due_d.items()},
+                        set_interval=True
+                )
+
+                # schedule our cards
+                self._deck.set_anki_due_from_subid(
+                        {id: v[1] for id, v in sub_with_interval_and_due_d.items()},
+                        set_interval=False
+                )
+
+        # the assignments were read after cur_time, the next run only needs the ones changed since.
+        # the deck timestamp belongs to update_cards_from_wk and is kept as is
+        self._deck.set_metadata_time(MetadataFields.Types.STATUS, cur_time)
 
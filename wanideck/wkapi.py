@@ -1,20 +1,51 @@
 import requests
 from datetime import datetime
-import time
 import logging
-import base64
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Iterator
+from urllib.parse import urlparse
+
+from . import profiling
+from .ratelimit import RateLimiter
+from .session import create_session
+from .store import SubjectStore
 
 logger = logging.getLogger("api")
 logger.setLevel(logging.DEBUG)
 
+def _request_size(request: requests.PreparedRequest) -> int:
+    """bytes of the request line, headers and body (the gets have no body),
+    without the headers urllib3 adds itself"""
+    head = f"{request.method} {request.path_url} HTTP/1.1\r\n" + "".join(
+        f"{k}: {v}\r\n" for k, v in request.headers.items()
+    ) + "\r\n"
+    body = request.body or b""
+    return len(head.encode()) + len(body.encode() if isinstance(body, str) else body)
+
 class WaniKaniAPI:
     WANIKANI_URL: str = "https://api.wanikani.com/v2/{endpoint}"
+    MAX_LEVEL: int = 60
 
-    def __init__(self, *, api_token) -> None:
+    def __init__(
+            self, *, api_token, store: SubjectStore | None = None,
+            session: requests.Session | None = None, timeout: float | None = None,
+            partitions: int = 1, base_url: str | None = None
+        ) -> None:
         self._api_token = api_token
+        self._url = self.WANIKANI_URL if base_url is None else base_url.rstrip("/") + "/{endpoint}"
+        self._store = store
+        self._session = session if session is not None else create_session()
+        self._timeout = timeout
+        self.rate_limiter = RateLimiter()
+        # amount of level ranges full subject downloads are split into
+        self._partitions = partitions
 
     def _gen_url(self, endpoint: str):
-        return self.WANIKANI_URL.format(endpoint=endpoint)
+        return self._url.format(endpoint=endpoint)
 
     def _do_request(self, endpoint: None | str, url: None | str = None, params: dict | None = None):
         """ Does a request to an endpoint.
@@ -38,49 +69,151 @@ class WaniKaniAPI:
         )
         # doing the request and handling rate limiting (60 per minute)
         while True:
+            self.rate_limiter.acquire()
+
             logger.debug(f"Starting request {url}")
-            r = requests.get(url, headers=headers, params=params)
+            start = time.perf_counter()
+            r = self._session.get(url, headers=headers, params=params, timeout=self._timeout)
+            profiling.record_request(
+                "wanikani", endpoint or urlparse(url).path.rstrip("/").rsplit("/", 1)[-1],
+                time.perf_counter() - start, _request_size(r.request), len(r.content)
+            )
+            self.rate_limiter.update(r.headers)
+
             if r.status_code == 429:
-                ts =  int(r.headers["ratelimit-reset"])
-                d_time = datetime.fromtimestamp(ts) - datetime.now()
-                logger.info(f"Ran into ratelimit, will try again in {d_time.total_seconds()}s")
-                time.sleep(d_time.total_seconds())
+                # this should only happen if someone else uses our token,
+                # the limiter is blocked until the reset now
+                logger.info(f"Ran into ratelimit, will try again after {r.headers.get('RateLimit-Reset')}")
             else:
                 return r
 
-    def _do_request_paged(self, endpoint: str, params: dict | None = None):
-        pages = []
-
-        next_url = self._gen_url(endpoint)
-        while next_url:
-            logger.info(f"retrieving {next_url}")
-            r = self._do_request(endpoint=None, url=next_url, params=params)
-            params = None
+    def _iter_pages(self, endpoint: str, params: dict | None = None) -> Iterator[list[dict]]:
+        """yields the data of a paged endpoint page by page.
+        While a page is being processed, the next one is already downloaded"""
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            def fetch(url: str, params: dict | None = None):
+                logger.info(f"retrieving {url}")
+                return pool.submit(self._do_request, endpoint=None, url=url, params=params)
+
+            future = fetch(self._gen_url(endpoint), params)
+            while future is not None:
+                r = future.result()
+                assert r.status_code == 200
+
+                page = r.json()
+                next_url = page["pages"]["next_url"]
+                future = fetch(next_url) if next_url else None
+
+                yield page["data"]
+
+    def _iter_pages_partitioned(self, endpoint: str, params: dict, levels: list[int]) -> Iterator[list[dict]]:
+        """pages the endpoint split into level ranges, which are downloaded
+        concurrently (sharing the rate limit). The pages are yielded ordered
+        by level range and page, each as soon as it arrived. A range only
+        downloads a few pages ahead of the one that is being yielded"""
+        n = min(self._partitions, len(levels))
+        size = -(-len(levels) // n)
+        ranges = [levels[i:i + size] for i in range(0, len(levels), size)]
+
+        end = object()
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=2) for _ in ranges]
+
+        def put(q: queue.Queue, item) -> bool:
+            # give up if the consumer stopped iterating
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def download(level_range: list[int], q: queue.Queue):
+            try:
+                for page in self._iter_pages(endpoint, params=dict(params, levels=level_range)):
+                    if not put(q, page):
+                        return
+                put(q, end)
+            except BaseException as e:
+                put(q, e)
+
+        logger.info(f"downloading {endpoint} in {len(ranges)} level partitions")
+        with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            for r, q in zip(ranges, queues):
+                pool.submit(download, r, q)
+
+            try:
+                for q in queues:
+                    while (item := q.get()) is not end:
+                        if isinstance(item, BaseException):
+                            raise item
+                        yield item
+            finally:
+                stop.set()
+
+    def _iter_subject_pages(self, params: dict, levels: list[int] | None = None) -> Iterator[list[dict]]:
+        """pages subjects, level partitioned if it is a full download"""
+        if self._partitions <= 1 or "updated_after" in params:
+            # deltas are usually a single page, splitting them is not worth it
+            if levels is not None:
+                params["levels"] = levels
+            return self._iter_pages("subjects", params=params)
+
+        if levels is None:
+            levels = list(range(1, self.MAX_LEVEL + 1))
+        return self._iter_pages_partitioned("subjects", params, levels)
+
+    def iter_all_subjects(self, last_update_ts: int | None = None, max_level: int | None = None) -> Iterator[list[dict]]:
+        """same as get_all_subjects, but yields the subjects page by page"""
+        if self._store is not None:
+            self._update_store()
+            yield from self._store.iter(last_update_ts, max_level)
+            return
 
-            assert r.status_code == 200
-            pages.append(r.json())
-            next_url = r.json()["pages"]["next_url"]
-
-        data = []
-        for p in pages:
-            data.extend(p["data"])
-
-        return data, pages
-
-    def get_all_subjects(self, last_update_ts: int | None = None, max_level: int | None = None):
         params = {}
         if last_update_ts is not None:
             dt = datetime.utcfromtimestamp(last_update_ts)
             params["updated_after"]= f"{dt.isoformat()}Z"
+        params["hidden"] = "false"
+
+        levels = None
         if max_level is not None:
-            params["levels"] = list(range(1, max_level + 1))
+            levels = list(range(1, max_level + 1))
 
-        params["hidden"] = "false"
+        yield from self._iter_subject_pages(params, levels)
 
-        data, _ = self._do_request_paged("subjects", params=params)
+    def get_all_subjects(self, last_update_ts: int | None = None, max_level: int | None = None):
+        data = list(chain.from_iterable(self.iter_all_subjects(last_update_ts, max_level)))
         logger.debug(f"got all subjects (len:{len(data)})")
         return data
 
+    def _update_store(self):
+        """merges all subjects updated since the last complete sync into the store.
+        Without one (e.g. the first sync was interrupted) everything is downloaded"""
+        assert self._store is not None
+
+        params = {}
+        synced_until = self._store.synced_until
+        if synced_until is not None:
+            params["updated_after"] = synced_until
+
+        count = 0
+        newest, newest_ts = synced_until, float("-inf")
+        for page in self._iter_subject_pages(params):
+            self._store.merge(page)
+            count += len(page)
+
+            for subject in page:
+                ts = SubjectStore._parse_ts(subject["data_updated_at"])
+                if ts > newest_ts:
+                    newest, newest_ts = subject["data_updated_at"], ts
+
+        # only now the store is complete up to the newest subject
+        if newest is not None:
+            self._store.set_synced_until(newest)
+        logger.info(f"merged {count} updated subjects into store")
+
     def get_user(self):
         return self._do_request("user").json()
 
@@ -95,21 +228,17 @@ class WaniKaniAPI:
             logging.warn("User is not subscriped to wanikani")
             return user["data"]["subscription"]["max_level_granted"]
 
-    def download_resource(self, url, b64encode: bool = True) -> str | bytes:
-        """Downloads resource and returns base64 string"""
-        r = self._do_request(endpoint=None, url=url)
-        if b64encode:
-            return base64.b64encode(r.content).decode("ascii")
-        else:
-            return r.content
-
-    def get_all_assignments(self, last_update_ts: int | None) -> list[dict]:
-        """returns all subjects and their current srs stage + more"""
+    def iter_all_assignments(self, last_update_ts: int | None) -> Iterator[list[dict]]:
+        """same as get_all_assignments, but yields the assignments page by page"""
         params = {}
         if last_update_ts is not None:
             dt = datetime.utcfromtimestamp(last_update_ts)
             params["updated_after"]= f"{dt.isoformat()}Z"
 
-        data, _ = self._do_request_paged("assignments", params=params)
+        yield from self._iter_pages("assignments", params=params)
+
+    def get_all_assignments(self, last_update_ts: int | None) -> list[dict]:
+        """returns all subjects and their current srs stage + more"""
+        data = list(chain.from_iterable(self.iter_all_assignments(last_update_ts)))
         logger.debug(f"go all assignments (len:{len(data)})")
         return data